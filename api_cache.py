@@ -0,0 +1,90 @@
+# Author: Brandon Le
+
+# On-disk cache of Pexels API responses with TTL, ETag revalidation and LRU eviction
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from json import (load as jsonload, dump as jsondump)
+
+# Constants
+CACHE_DIR = ".pexels-cache"
+DEFAULT_TTL = 15 * 60 # seconds a response is used without asking the API again
+MAX_BYTES = 50 * 2**20 # cache size before the least recently used entries are evicted
+EVICT_EVERY = 20 # writes between eviction passes
+
+class ApiCache:
+    """Persistent cache of API json responses, one file per url
+    Entries are keyed by the url and the API key, so accounts never see each other's data.
+    The file modification time records the last access and drives LRU eviction.
+    directory: string, folder to keep the cache in
+    ttl: int, seconds an entry is fresh
+    max_bytes: int, size limit of the cache folder
+    """
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.writes = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url, auth):
+        key = hashlib.sha256(f"{auth.get('Authorization', '')} {url}".encode()).hexdigest()
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, url, auth):
+        """The cached entry for url (a dict with body, etag and time), fresh or not, or None"""
+        path = self.path(url, auth)
+        try:
+            with open(path, 'r') as f:
+                entry = jsonload(f)
+            os.utime(path) # Mark as recently used
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry["time"] < self.ttl
+
+    def put(self, url, auth, body, etag=None):
+        """Store a response body, written atomically so parallel readers never see half a file"""
+        entry = {"url": url, "etag": etag, "time": time.time(), "body": body}
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            jsondump(entry, f)
+        os.replace(temp_path, self.path(url, auth))
+        with self.lock:
+            self.writes += 1
+            evict = self.writes % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def touch(self, url, auth, entry):
+        """Restart the TTL of an entry the API confirmed is unchanged (304 Not Modified)"""
+        self.put(url, auth, entry["body"], entry["etag"])
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes"""
+        with self.lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".tmp"): # Still being written
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                    total -= size
+                except OSError:
+                    pass
+
@@ -0,0 +1,100 @@
+# Author: Brandon Le
+
+# End-to-end benchmark of collection jobs against the local mock Pexels API, no network needed
+# Measures the account listing, the collection listing (cold and from the cache), the time to
+# the first downloaded file and the throughput of a whole job for collections of every size.
+# Run from the repository root: python benchmarks/bench_api.py
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_pexels import API_KEY, MockPexels, make_collections
+
+# Constants
+HOURLY_LIMIT = 10**6 # Requests per hour the scheduler allows, high enough to never wait
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Collection listing and download job timings against a mock API")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000],
+        help="media items per collection")
+    parser.add_argument("--collections", type=int, default=500, help="collections in the account")
+    parser.add_argument("--media", default="photo_video", help="photo_video, photo or video")
+    parser.add_argument("--quality", default="large", help="photo src variant to download")
+    parser.add_argument("--video-share", type=float, default=0.05, help="share of the media that are videos")
+    parser.add_argument("--photo-size", type=int, default=2**20, help="bytes of an original photo")
+    parser.add_argument("--video-size", type=int, default=2 * 2**20, help="bytes of a video")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="MiB/s per connection, no limit by default")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests answered with 429")
+    parser.add_argument("--jobs", type=int, default=None, help="concurrent downloads, the app default if not set")
+    args = parser.parse_args()
+
+    # The benchmark collections first, then one-item collections to fill up the account
+    media_counts = args.sizes + [1] * max(0, args.collections - len(args.sizes))
+    mock = MockPexels(make_collections(media_counts, args.video_share), latency=args.latency,
+        bandwidth=args.bandwidth * 2**20 if args.bandwidth else None, photo_size=args.photo_size,
+        video_size=args.video_size, error_rate=args.error_rate)
+    with mock:
+        # Imported once the environment points them at the mock
+        os.environ.update(mock.environ())
+        import pexels_api
+        import pexels_dl
+        from pipeline import fetch_media
+        from scheduler import RequestScheduler
+
+        with tempfile.TemporaryDirectory() as home:
+            settings = {"pexels_api_key": API_KEY, "home": home}
+            pexels_api.scheduler = RequestScheduler(hourly_limit=HOURLY_LIMIT)
+            pexels_dl.open_cache(settings)
+            collections, cold = timed(lambda: pexels_dl.list_collections(settings))
+            _, cached = timed(lambda: pexels_dl.list_collections(settings))
+            _, revalidated = timed(lambda: pexels_dl.list_collections(settings, refresh=True))
+        print(f"{len(collections)} collections, {args.latency * 1000:.0f} ms latency: listed in {cold:.2f}s, "
+            f"{cached:.3f}s cached, {revalidated:.2f}s revalidated")
+
+        print(f"{'items':>7}{'requests':>10}{'list':>8}{'cached':>8}{'first':>8}{'job':>9}{'files/s':>9}{'MiB/s':>8}")
+        for collection in collections[:len(args.sizes)]:
+            with tempfile.TemporaryDirectory() as home:
+                settings = {"pexels_api_key": API_KEY, "home": home}
+                auth = pexels_dl.auth_header(settings)
+                media_count = collection['media_count']
+                pexels_api.scheduler = RequestScheduler(hourly_limit=HOURLY_LIMIT)
+                pexels_dl.open_cache(settings)
+                requests_before = mock.api_requests
+                _, listed = timed(lambda: list(fetch_media(collection['id'], auth, media_count)))
+                requests = mock.api_requests - requests_before
+                _, listed_cached = timed(lambda: list(fetch_media(collection['id'], auth, media_count)))
+
+                # The job starts cold, like a first download of the collection
+                pexels_api.cache = None
+                options = {} if args.jobs is None else {"jobs": args.jobs}
+                download_dir = os.path.join(home, "download")
+                os.makedirs(download_dir)
+                job = pexels_dl.sync_collection(settings, collection['id'], download_dir, media=args.media,
+                    quality=args.quality, media_count=media_count, **options)
+                start = time.perf_counter()
+                first = None
+                files = total_bytes = 0
+                for result in job:
+                    if first is None:
+                        first = time.perf_counter() - start
+                    if result.ok:
+                        files += 1
+                        total_bytes += result.info["size"]
+                elapsed = time.perf_counter() - start
+                if job.failed:
+                    print(f"{job.failed} downloads failed")
+            print(f"{media_count:>7}{requests:>10}{listed:>7.2f}s{listed_cached:>7.3f}s{first or 0:>7.2f}s"
+                f"{elapsed:>8.2f}s{files / elapsed:>9.1f}{total_bytes / elapsed / 2**20:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Author: Brandon Le
+
+# Compare the old serial download loop with the concurrent download engine
+# Run from the repository root: python benchmarks/bench_download.py
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from downloader import Media, download_media
+from server import LocalServer
+
+def serial_download(urls, download_dir):
+    """The original download_media loop: one fresh request per url, no shared session"""
+    for media in urls:
+        file_name = download_dir + (media.split('/')[-1]).split("?")[0]
+        r = requests.get(media, stream=True)
+        if r.status_code == 200:
+            with open(file_name, 'wb') as f:
+                for chunk in r:
+                    f.write(chunk)
+
+def run(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def report(label, elapsed, total_bytes, baseline):
+    print(f"{label:<12}{elapsed:>8.2f}s{total_bytes / elapsed / 2**20:>10.1f} MiB/s{baseline / elapsed:>8.1f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Serial vs concurrent download throughput")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--size", type=int, default=256 * 1024, help="bytes per file")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[4, 8, 16])
+    args = parser.parse_args()
+
+    with LocalServer(file_size=args.size, latency=args.latency) as server:
+        urls = [f"{server.url}/files/pexels-photo-{i}.jpeg" for i in range(args.files)]
+        total_bytes = args.files * args.size
+        print(f"{args.files} files x {args.size} bytes, {args.latency * 1000:.0f} ms latency")
+        with tempfile.TemporaryDirectory() as tmp:
+            download_dir = tmp + "/"
+            serial = run(lambda: serial_download(urls, download_dir))
+            report("serial", serial, total_bytes, serial)
+            for jobs in args.jobs:
+                elapsed = run(lambda: download_media(urls, download_dir, Media.photo, jobs=jobs))
+                report(f"jobs={jobs}", elapsed, total_bytes, serial)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Author: Brandon Le
+
+# Compare one connection per file with ranged transfers over several connections, per file size
+# The local server limits the bandwidth of every connection, like a CDN or a long fat link does.
+# Run from the repository root: python benchmarks/bench_ranges.py
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from downloader import SessionPool, download_file
+from server import LocalServer
+
+def run(url, file_name, parts, chunk_size):
+    with SessionPool(1, parts) as sessions:
+        start = time.perf_counter()
+        info = download_file(sessions, url, file_name, chunk_size=chunk_size, parts=parts)
+        elapsed = time.perf_counter() - start
+    if info is None:
+        sys.exit(f"Download of {url} failed")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Single connection vs ranged download throughput")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[16, 32, 64, 128],
+        help="file sizes in MiB, files under RANGE_MIN_SIZE are never split")
+    parser.add_argument("--bandwidth", type=float, default=16, help="MiB/s per connection")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    parser.add_argument("--parts", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--buffer-size", type=int, default=64 * 1024, help="read buffer in bytes")
+    args = parser.parse_args()
+
+    print(f"{args.bandwidth:.0f} MiB/s per connection, {args.latency * 1000:.0f} ms latency, "
+        f"{args.buffer_size // 1024} KiB buffer")
+    print(f"{'size':>9}{'parts':>7}{'time':>9}{'MiB/s':>9}{'gain':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        file_name = os.path.join(tmp, "video.mp4")
+        for size in args.sizes:
+            options = dict(file_size=size * 2**20, latency=args.latency, bandwidth=args.bandwidth * 2**20)
+            with LocalServer(**options) as server:
+                url = f"{server.url}/files/video.mp4"
+                single = run(url, file_name, 1, args.buffer_size)
+                print(f"{size:>5} MiB{1:>7}{single:>8.2f}s{size / single:>9.1f}{1:>6.1f}x")
+                for parts in args.parts:
+                    elapsed = run(url, file_name, parts, args.buffer_size)
+                    print(f"{size:>5} MiB{parts:>7}{elapsed:>8.2f}s{size / elapsed:>9.1f}{single / elapsed:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
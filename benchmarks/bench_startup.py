@@ -0,0 +1,86 @@
+# Author: Brandon Le
+
+# Time what stands between launching the GUI and a usable window, each step in a fresh interpreter
+# The GUI shows its window once the light modules are imported and the cached collection list is
+# read. Importing the download engine and paging the collections from the API (here the mock in
+# mock_pexels.py) happen in the background afterwards, before they delayed the window.
+# Run from the repository root: python benchmarks/bench_startup.py
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_pexels import API_KEY, MockPexels, make_collections
+
+# Constants
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Each step runs in its own interpreter: its setup, then its code, printing the seconds the code took
+SCRIPT = """
+import sys, time
+sys.path.insert(0, {root!r})
+settings = {{"pexels_api_key": {key!r}, "home": sys.argv[1]}}
+{setup}
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+"""
+# name, setup, code
+STEPS = [
+    ("window modules", "", "import config, progress"),
+    ("cached collection list", "import config", "config.cached_collections(settings)"),
+    ("download engine", "", "import pexels_dl"),
+    ("first page from the API", "import pexels_dl", "next(pexels_dl.iter_collections(settings))"),
+    ("all pages from the API", "import pexels_dl", "pexels_dl.list_collections(settings)"),
+]
+
+def step_script(setup, code):
+    return SCRIPT.format(root=ROOT, key=API_KEY, setup=setup, code=code)
+
+def run_python(args, env, runs):
+    """Median seconds of runs fresh interpreters, as they report it or measured from outside"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable] + args, env=env, check=True, capture_output=True,
+            text=True).stdout
+        times.append(float(output) if output.strip() else time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup steps of the GUI, each in a fresh interpreter")
+    parser.add_argument("--collections", type=int, default=500, help="collections in the account")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per API request")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters per step, the median is shown")
+    args = parser.parse_args()
+
+    mock = MockPexels(make_collections([1] * args.collections), latency=args.latency)
+    with mock, tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, **mock.environ())
+        # Fill the cache the way a previous run of the app would have
+        subprocess.run([sys.executable, "-c", step_script("import pexels_dl", "pexels_dl.open_cache(settings); "
+            "pexels_dl.list_collections(settings)"), home], env=env, check=True, capture_output=True)
+        gui = subprocess.run([sys.executable, "-c", "import PySimpleGUI"], capture_output=True).returncode == 0
+        print(f"{args.collections} collections, {args.latency * 1000:.0f} ms API latency, "
+            f"median of {args.runs} runs")
+        timings = {"interpreter": run_python(["-c", "pass"], env, args.runs)}
+        print(f"{'interpreter':<40}{timings['interpreter'] * 1000:>9.0f} ms")
+        for name, setup, code in STEPS:
+            if name == "window modules" and gui: # The window needs PySimpleGUI in any case
+                code += ", PySimpleGUI"
+                name += " and PySimpleGUI"
+            timings[name] = run_python(["-c", step_script(setup, code), home], env, args.runs)
+            print(f"{name:<40}{timings[name] * 1000:>9.0f} ms")
+
+        window = sum(seconds for name, seconds in timings.items() if name.startswith(("window", "cached")))
+        engine = timings["download engine"]
+        print(f"Window shown after {window * 1000:.0f} ms, without a cache its list starts filling in after "
+            f"{(window + engine + timings['first page from the API']) * 1000:.0f} ms")
+        print(f"Loading the engine and the collections before the window took {(window + engine) * 1000:.0f} ms "
+            f"with a cache, {(window + engine + timings['all pages from the API']) * 1000:.0f} ms without")
+
+if __name__ == "__main__":
+    main()
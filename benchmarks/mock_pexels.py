@@ -0,0 +1,213 @@
+# Author: Brandon Le
+
+# Local mock of the Pexels API and its media hosts, for the benchmarks
+# Serves the collection endpoints with Pexels' pagination and json fields, photo files behind
+# every src variant, video downloads behind a redirect, X-Ratelimit-* headers and 429s, with
+# a configurable latency and bandwidth. Point the app at it with mock.environ().
+
+import hashlib
+import random
+import re
+import threading
+import time
+from json import dumps as jsondumps
+from urllib.parse import parse_qs, urlsplit
+
+from server import FileHandler, LocalServer
+
+# Constants
+PER_PAGE = 15 # Pexels default
+MAX_PER_PAGE = 80
+MONTHLY_LIMIT = 20000 # Pexels default, requests per month
+API_KEY = "mock-api-key"
+# Query of each photo src variant, as the API returns them
+SRC_VARIANTS = {
+    "original": "",
+    "large2x": "?auto=compress&cs=tinysrgb&dpr=2&h=650&w=940",
+    "large": "?auto=compress&cs=tinysrgb&h=650&w=940",
+    "medium": "?auto=compress&cs=tinysrgb&h=350",
+    "small": "?auto=compress&cs=tinysrgb&h=130",
+    "portrait": "?auto=compress&cs=tinysrgb&fit=crop&h=1200&w=800",
+    "landscape": "?auto=compress&cs=tinysrgb&fit=crop&h=627&w=1200",
+    "tiny": "?auto=compress&cs=tinysrgb&dpr=1&fit=crop&h=200&w=280",
+}
+# File size of each variant as a share of the original's
+VARIANT_SHARE = {"original": 1, "large2x": 0.3, "large": 0.12, "medium": 0.04, "small": 0.01,
+    "portrait": 0.15, "landscape": 0.12, "tiny": 0.01}
+
+def make_collections(media_counts, video_share=0.1, seed=0):
+    """Collections for the mock account, a list of dicts with id, title and media
+    Media are dicts with id and type, unique over all collections.
+    media_counts: list of ints, number of media items in each collection
+    video_share: float, share of the media that are videos
+    seed: int, the same seed gives the same account
+    """
+    rng = random.Random(seed)
+    collections = []
+    next_id = 1000000
+    for number, media_count in enumerate(media_counts):
+        media = []
+        for _ in range(media_count):
+            media.append({"id": next_id, "type": "Video" if rng.random() < video_share else "Photo"})
+            next_id += 1
+        collections.append({"id": f"mock{number:05d}", "title": f"Collection {number} ({media_count} items)",
+            "media": media})
+    return collections
+
+class PexelsHandler(FileHandler):
+    """Answer like api.pexels.com, images.pexels.com and www.pexels.com/video at once
+    Reads the MockPexels attributes of the server.
+    """
+    disable_nagle_algorithm = True # Small json responses, one write for the headers and one for the body
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        time.sleep(self.server.latency)
+        photo = re.fullmatch(r"/photos/(\d+)/pexels-photo-\d+\.jpeg", url.path)
+        video = re.fullmatch(r"/video/(\d+)/download", url.path)
+        if url.path.startswith("/v1/"):
+            self.api(url.path, query)
+        elif photo:
+            variant = f"?{url.query}" if url.query else ""
+            quality = next((name for name, value in SRC_VARIANTS.items() if value == variant), "original")
+            size = max(1024, int(self.server.photo_size * VARIANT_SHARE[quality]))
+            self.send_file(size, self.path.encode() + b"\n", "image/jpeg")
+        elif video: # www.pexels.com/video/<id>/download redirects to the file on the video host
+            self.send_response(302)
+            self.send_header("Location", f"/video-files/{video.group(1)}/video.mp4")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif re.fullmatch(r"/video-files/\d+/video\.mp4", url.path):
+            self.send_file(self.server.video_size, self.path.encode() + b"\n", "video/mp4")
+        else:
+            self.send_error(404)
+
+    def api(self, path, query):
+        """Collection endpoints, behind the API key check and the request quota"""
+        if self.server.api_key and self.headers.get("Authorization") != self.server.api_key:
+            self.send_json(401, {"error": "Unauthorized"})
+            return
+        with self.server.lock:
+            self.server.api_requests += 1
+            limited = self.server.remaining <= 0
+            busy = not limited and self.server.rng.random() < self.server.error_rate
+            if not limited and not busy:
+                self.server.remaining -= 1
+        if limited:
+            self.send_json(429, {"error": "Rate limit exceeded"})
+            return
+        if busy: # A burst the client should retry, the quota is not used up
+            self.send_json(429, {"error": "Too many requests"}, {"Retry-After": "0"})
+            return
+        try:
+            page = max(1, int(query.get("page", 1)))
+            per_page = min(MAX_PER_PAGE, max(1, int(query.get("per_page", PER_PAGE))))
+        except ValueError:
+            self.send_json(400, {"error": "Invalid page"})
+            return
+        if path == "/v1/collections/":
+            items = [{"id": collection["id"], "title": collection["title"], "description": None,
+                "private": False, "media_count": len(collection["media"]),
+                "photos_count": sum(media["type"] == "Photo" for media in collection["media"]),
+                "videos_count": sum(media["type"] == "Video" for media in collection["media"])}
+                for collection in self.server.collections]
+            self.send_page(path, query, {}, "collections", items, page, per_page)
+            return
+        match = re.fullmatch(r"/v1/collections/(\w+)", path)
+        collection = self.server.by_id.get(match.group(1)) if match else None
+        if collection is None:
+            self.send_json(404, {"error": "Not Found"})
+            return
+        media = collection["media"]
+        kind = {"photos": "Photo", "videos": "Video"}.get(query.get("type"))
+        if kind:
+            media = [item for item in media if item["type"] == kind]
+        start = (page - 1) * per_page
+        items = [self.media_json(item) for item in media[start:start + per_page]]
+        self.send_page(path, query, {"id": collection["id"]}, "media", items, page, per_page, len(media), start)
+
+    def media_json(self, item):
+        """Photo or Video resource of a media item, with urls pointing back at the mock"""
+        base = self.server.base_url
+        media_id = item["id"]
+        if item["type"] == "Photo":
+            original = f"{base}/photos/{media_id}/pexels-photo-{media_id}.jpeg"
+            return {"type": "Photo", "id": media_id, "width": 4000, "height": 6000,
+                "url": f"{base}/photo/{media_id}/", "photographer": "Mock Photographer",
+                "avg_color": "#7E7E7E", "alt": "", "liked": False,
+                "src": {name: original + variant for name, variant in SRC_VARIANTS.items()}}
+        return {"type": "Video", "id": media_id, "width": 1920, "height": 1080, "duration": 10,
+            "url": f"{base}/video/{media_id}/", "image": f"{base}/videos/{media_id}/pictures/preview-0.jpg",
+            "video_files": [{"id": media_id, "quality": "hd", "file_type": "video/mp4", "width": 1920,
+                "height": 1080, "link": f"{base}/video-files/{media_id}/video.mp4"}],
+            "video_pictures": []}
+
+    def send_page(self, path, query, fields, field, items, page, per_page, total=None, start=None):
+        """One page of a paginated endpoint, items is the whole list unless start is given"""
+        if total is None:
+            total = len(items)
+            start = (page - 1) * per_page
+            items = items[start:start + per_page]
+        body = {**fields, field: items, "page": page, "per_page": per_page, "total_results": total}
+        other = "".join(f"&{name}={value}" for name, value in query.items() if name not in ("page", "per_page"))
+        if start + per_page < total:
+            body["next_page"] = f"{self.server.base_url}{path}?page={page + 1}&per_page={per_page}{other}"
+        if page > 1:
+            body["prev_page"] = f"{self.server.base_url}{path}?page={page - 1}&per_page={per_page}{other}"
+        self.send_json(200, body)
+
+    def send_json(self, status, body, headers=None):
+        data = jsondumps(body).encode()
+        etag = '"' + hashlib.md5(data).hexdigest() + '"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status, data = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        with self.server.lock:
+            remaining = max(0, self.server.remaining)
+        self.send_header("X-Ratelimit-Limit", str(self.server.monthly_limit))
+        self.send_header("X-Ratelimit-Remaining", str(remaining))
+        self.send_header("X-Ratelimit-Reset", str(self.server.reset))
+        if status in (200, 304):
+            self.send_header("ETag", etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+class MockPexels(LocalServer):
+    """Mock Pexels account on a free localhost port, use it as a context manager
+    collections: list of dicts, as returned by make_collections
+    api_key: string, key the API expects in the Authorization header, None to accept any
+    latency: float, seconds before every response
+    bandwidth: float, bytes per second per connection for files, None for no limit
+    photo_size: int, bytes of an original photo, the other variants are smaller (see VARIANT_SHARE)
+    video_size: int, bytes of a video
+    monthly_limit: int, API requests before every further one is answered with 429
+    error_rate: float, share of API requests answered with a 429 that is worth retrying
+    seed: int, seed of the error_rate draws
+    """
+    def __init__(self, collections, api_key=API_KEY, latency=0.0, bandwidth=None, photo_size=512 * 1024,
+            video_size=4 * 2**20, monthly_limit=MONTHLY_LIMIT, error_rate=0.0, seed=0):
+        super().__init__(PexelsHandler, collections=collections, api_key=api_key, latency=latency,
+            bandwidth=bandwidth, photo_size=photo_size, video_size=video_size, monthly_limit=monthly_limit,
+            error_rate=error_rate)
+        self.httpd.by_id = {collection["id"]: collection for collection in collections}
+        self.httpd.remaining = monthly_limit
+        self.httpd.reset = int(time.time()) + 30 * 24 * 3600
+        self.httpd.api_requests = 0
+        self.httpd.rng = random.Random(seed)
+        self.httpd.lock = threading.Lock()
+        self.httpd.base_url = self.url
+
+    @property
+    def api_requests(self):
+        """API requests answered so far, 429s included"""
+        with self.httpd.lock:
+            return self.httpd.api_requests
+
+    def environ(self):
+        """Environment variables that point pexels_api and pipeline at the mock, set them before importing those"""
+        return {"PEXELS_API_URL": f"{self.url}/v1/", "PEXELS_VIDEO_URL": f"{self.url}/video/"}
@@ -0,0 +1,100 @@
+# Author: Brandon Le
+
+# Local stand-in HTTP server for the benchmarks
+
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import time
+
+# Constants
+BLOCK_SIZE = 64 * 1024 # bytes written between bandwidth checks
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serve /files/<name> as a block of zero bytes after a fixed latency
+    Reads latency, file_size and bandwidth (bytes per second per connection, None for no
+    limit) from the server, and answers Range requests like a CDN.
+    """
+    protocol_version = "HTTP/1.1" # Keep-alive, like images.pexels.com
+    disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+    def log_message(self, format, *args): # Keep the benchmark output clean
+        pass
+
+    def do_GET(self):
+        if not self.path.startswith("/files/"):
+            self.send_error(404)
+            return
+        time.sleep(self.server.latency)
+        self.send_file(self.server.file_size)
+
+    def send_file(self, size, prefix=b"", content_type="application/octet-stream"):
+        """Answer with a file of size bytes, prefix followed by zeros, honouring a Range header
+        prefix: bytes, start of the file, makes files differ from each other
+        """
+        start, end = 0, size
+        byte_range = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if byte_range:
+            start = int(byte_range.group(1))
+            end = min(size, int(byte_range.group(2)) + 1) if byte_range.group(2) else size
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        try:
+            self.send_body(start, end, prefix[:size])
+        except (BrokenPipeError, ConnectionResetError): # The client switched to range requests
+            self.close_connection = True
+
+    def send_body(self, start, end, prefix=b""):
+        """Write bytes start to end of prefix + zeros, at no more than the server's bandwidth"""
+        bandwidth = getattr(self.server, "bandwidth", None)
+        head = prefix[start:end]
+        if head:
+            self.wfile.write(head)
+        sent = start + len(head)
+        block = b"\0" * BLOCK_SIZE
+        started = time.perf_counter()
+        while sent < end:
+            count = min(BLOCK_SIZE, end - sent)
+            self.wfile.write(block[:count])
+            sent += count
+            # Sleep until this connection is back under its bandwidth
+            delay = (sent - start) / bandwidth - (time.perf_counter() - started) if bandwidth else 0
+            if delay > 0:
+                time.sleep(delay)
+
+class LocalServer:
+    """Run a ThreadingHTTPServer on a free localhost port in a background thread
+    handler: BaseHTTPRequestHandler subclass, request handler
+    options: attributes copied onto the server for the handler to read
+    """
+    def __init__(self, handler=FileHandler, **options):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        for key, value in options.items():
+            setattr(self.httpd, key, value)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
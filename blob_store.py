@@ -0,0 +1,130 @@
+# Author: Brandon Le
+
+# Content-addressed store of downloaded media, shared by every download location
+# Each file is kept once under its sha256 in the home directory and hardlinked into the
+# folders it was downloaded to, so the same media in several folders takes the disk space once.
+
+import os
+import re
+import threading
+from json import (load as jsonload, dump as jsondump)
+
+from downloader import download_file, link_or_copy
+from metrics import recorder
+
+# Constants
+STORE_DIR = ".pexels-store"
+INDEX_FILE = "index.json"
+SAVE_EVERY = 50 # Downloads between saves of the index
+
+class BlobStore:
+    """Downloaded files keyed by their sha256, plus an index from media key to blob
+    Files are hashed as they download (see download_file), so adding one never reads it again.
+    A media key (id + quality) that is already in the store is materialized without any
+    network I/O. Folders hold hardlinks to the blobs, or copies on another drive.
+    directory: string, folder to keep the store in
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.entries = {} # media key -> url, sha256, size, etag
+        self.inflight = {} # media key -> Event set once its download finished
+        self.writes = 0
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "tmp"), exist_ok=True)
+        try:
+            with open(self.index_path, 'r') as f:
+                self.entries = jsonload(f)["media"]
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+
+    def blob_path(self, sha256):
+        return os.path.join(self.directory, "blobs", sha256[:2], sha256)
+
+    def lookup(self, key):
+        """Index entry of key if its blob is still on disk, checked without any network I/O"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        try:
+            if os.path.getsize(self.blob_path(entry["sha256"])) == entry["size"]:
+                return entry
+        except OSError:
+            pass
+        return None
+
+    def add(self, key, url, file_name, info):
+        """Move a finished download into the store and index it under key
+        A blob with the same content already in the store is kept and the new file dropped.
+        """
+        path = self.blob_path(info["sha256"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(file_name)
+        else:
+            os.replace(file_name, path)
+        with self.lock:
+            self.entries[key] = {"url": url, "sha256": info["sha256"], "size": info["size"],
+                "etag": info.get("etag")}
+            self.writes += 1
+            save = self.writes % SAVE_EVERY == 0
+        if save:
+            self.save()
+
+    def materialize(self, entry, file_name):
+        """Put the blob of an index entry at file_name, returns it as a download_file dict"""
+        path = self.blob_path(entry["sha256"])
+        try:
+            linked = os.path.samefile(path, file_name)
+        except OSError:
+            linked = False
+        if not linked:
+            link_or_copy(path, file_name)
+        return {"size": entry["size"], "etag": entry.get("etag"), "sha256": entry["sha256"]}
+
+    def fetch(self, sessions, job, progress=None, control=None, refresh=False, **options):
+        """Download stage for run_pipeline: link the Job's file from the store, downloading it first if needed
+        Workers asking for a key that is being downloaded wait for that download instead of
+        starting another one.
+        refresh: bool, download the file again even if the store has it
+        options: passed on to download_file (chunk_size, parts)
+        """
+        while True:
+            with self.lock:
+                entry = None if refresh else self.lookup(job.key)
+                event = self.inflight.get(job.key)
+                if entry is None and event is None: # Ours to download
+                    event = self.inflight[job.key] = threading.Event()
+                    break
+            if entry is not None:
+                recorder.record("store_hit", key=job.key, bytes=entry["size"])
+                return self.materialize(entry, job.file_name)
+            event.wait()
+            refresh = False # The other worker just downloaded it
+        try:
+            # One temp name per key, so an interrupted download resumes from its .part file
+            temp_name = os.path.join(self.directory, "tmp", re.sub(r"[^\w.-]", "-", job.key))
+            info = download_file(sessions, job.url, temp_name, progress=progress, control=control, **options)
+            if info is None:
+                return None
+            self.add(job.key, job.url, temp_name, info)
+            return self.materialize(self.entries[job.key], job.file_name)
+        finally:
+            with self.lock:
+                del self.inflight[job.key]
+            event.set()
+
+    def save(self):
+        """Write the index atomically, merged with the one on disk so parallel jobs keep each other's entries"""
+        with self.lock:
+            try:
+                with open(self.index_path, 'r') as f:
+                    entries = jsonload(f)["media"]
+            except (OSError, ValueError, KeyError):
+                entries = {}
+            entries.update(self.entries)
+            self.entries = entries
+            temp_path = self.index_path + f".{threading.get_ident()}.tmp"
+            with open(temp_path, 'w') as f:
+                jsondump({"version": 1, "media": entries}, f)
+            os.replace(temp_path, self.index_path)
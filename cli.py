@@ -0,0 +1,143 @@
+# Author: Brandon Le
+
+# Headless command line for the Pexels Collection Downloader, no display needed
+# Usage:
+#   python cli.py list
+#   python cli.py sync <collection-id> --media photo --quality large2x --jobs 16 --out DIR
+#   python cli.py sync <collection-id> --quality original --quality tiny --derive
+#   python cli.py --events events.jsonl --metrics-port 9100 sync --all
+#   python cli.py sync --all --out DIR
+
+import argparse
+import os
+import sys
+
+from derivatives import can_derive
+from downloader import CHUNK_SIZE, DEFAULT_JOBS, RANGE_PARTS
+from metrics import recorder, report, serve_metrics
+from pexels_dl import (API_ERRORS, MEDIA_VALUES, QUALITY_VALUES, CollectionIndex, default_settings, job_gauges,
+    list_collections, load_settings, open_cache, open_store, plan_job, quota_status, settings_file,
+    sync_collection, sync_collections)
+from progress import Progress
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+def cli_settings(args):
+    """Settings from settings.json, overridden by PEXELS_API_KEY (also read from .env) and --api-key"""
+    settings = dict(load_settings(args.settings, default_settings))
+    if load_dotenv is not None:
+        load_dotenv()
+    settings["pexels_api_key"] = args.api_key or os.environ.get("PEXELS_API_KEY") or settings["pexels_api_key"]
+    return settings
+
+def list_command(settings, args):
+    for collection in sorted(list_collections(settings, args.refresh), key=lambda c: c['title'].lower()):
+        print(f"{collection['id']}\t{collection['media_count']}\t{collection['title']}")
+    return 0
+
+def sync_command(settings, args, progress=None):
+    out = args.out or str(settings['home'])
+    os.makedirs(out, exist_ok=True)
+    start = recorder.snapshot()
+    options = dict(media=args.media, quality=args.quality or ["original"], jobs=args.jobs, sync=not args.full,
+        prune=args.prune, refresh=args.refresh, derive=args.derive, chunk_size=args.buffer_size,
+        connections=args.connections, progress=progress)
+    if len(args.collection_id) == 1 and not args.all:
+        job = sync_collection(settings, args.collection_id[0], out, **options)
+    else: # Several collections, each in its own subdirectory
+        index = CollectionIndex(list_collections(settings, args.refresh))
+        ids = list(index.by_id) if args.all else args.collection_id
+        unknown = [i for i in ids if i not in index.by_id]
+        if unknown:
+            print(f"Unknown collection ids: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        collections = [index.by_id[i] for i in ids]
+        print(plan_job(*[collection['media_count'] for collection in collections]))
+        job = sync_collections(settings, collections, out, **options)
+    good, broken = 0, 0
+    for result in job:
+        if result.ok:
+            good += 1
+        else:
+            broken += 1
+            print(f"Broken url: {result.job.url}", file=sys.stderr)
+        if not args.quiet:
+            print(f"{'OK' if result.ok else 'FAILED'}\t{result.job.file_name}")
+    print(f"Downloaded {good}, failed {broken}, skipped {job.skipped}, deleted {len(job.deleted)}")
+    print(report(recorder.since(start)))
+    print(quota_status())
+    return 1 if broken else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="pexels-dl", description="Download Pexels collections")
+    parser.add_argument("--api-key", help="Pexels API key, defaults to $PEXELS_API_KEY or settings.json")
+    parser.add_argument("--settings", default=settings_file, help="settings file (default: %(default)s)")
+    parser.add_argument("--refresh", action="store_true", help="ask the API again instead of using cached pages")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the API cache")
+    parser.add_argument("--events", metavar="FILE", help="append a json line per request and download to FILE")
+    parser.add_argument("--metrics-port", type=int, metavar="PORT",
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics (and json on /stats) while running")
+    parser.add_argument("--no-store", action="store_true",
+        help="download straight to the output folder instead of through the shared file store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list the collections of the account")
+
+    sync = commands.add_parser("sync", help="download collections, skipping files already downloaded")
+    sync.add_argument("collection_id", nargs="*", help="one or more collection ids")
+    sync.add_argument("--all", action="store_true", help="download every collection of the account")
+    sync.add_argument("--media", choices=MEDIA_VALUES, default="photo_video")
+    sync.add_argument("--quality", choices=QUALITY_VALUES, action="append",
+        help="photo quality, repeat it to download several in one pass (default: original)")
+    sync.add_argument("--derive", action="store_true",
+        help="download only the originals and make the other qualities from them (needs Pillow)")
+    sync.add_argument("--jobs", type=int, default=DEFAULT_JOBS, help="concurrent downloads")
+    sync.add_argument("--connections", type=int, default=RANGE_PARTS,
+        help="connections per large file such as a 4K video (default: %(default)s)")
+    sync.add_argument("--buffer-size", type=int, default=CHUNK_SIZE, help="read buffer in bytes (default: %(default)s)")
+    sync.add_argument("--out", help="download directory, defaults to the home setting")
+    sync.add_argument("--full", action="store_true", help="download every file again")
+    sync.add_argument("--prune", action="store_true", help="delete files removed from the collection")
+    sync.add_argument("-q", "--quiet", action="store_true", help="only print the summary")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings = cli_settings(args)
+    if not settings["pexels_api_key"]:
+        print("No API key, set it with --api-key, $PEXELS_API_KEY or settings.json", file=sys.stderr)
+        return 2
+    if args.command == "sync" and not args.collection_id and not args.all:
+        print("Give one or more collection ids or --all", file=sys.stderr)
+        return 2
+    if args.command == "sync" and args.derive and not can_derive():
+        print("--derive needs Pillow, install it with pip install Pillow", file=sys.stderr)
+        return 2
+    if not args.no_cache:
+        open_cache(settings)
+    if not args.no_store:
+        open_store(settings)
+    if args.events:
+        recorder.open_log(args.events)
+    progress = Progress()
+    server = serve_metrics(args.metrics_port, lambda: job_gauges(progress)) if args.metrics_port else None
+    try:
+        if args.command == "list":
+            return list_command(settings, args)
+        return sync_command(settings, args, progress)
+    except API_ERRORS as e:
+        print(f"Problem talking to the Pexels API: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("Interrupted, run the same command again to resume", file=sys.stderr)
+        return 130
+    finally:
+        recorder.close_log()
+        if server is not None:
+            server.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
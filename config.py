@@ -0,0 +1,74 @@
+# Author: Brandon Le
+
+# Settings, option values and API endpoints, plus the cached collection list
+# Imports neither requests nor Pillow, so the GUI can show its window before the download
+# engine (pexels_dl) has loaded.
+
+import os
+from collections import Counter
+from json import load as jsonload
+
+from api_cache import CACHE_DIR, ApiCache
+
+# Constants
+# PEXELS_API_URL points the app at another server, such as the mock in benchmarks/mock_pexels.py
+API_URL = os.environ.get("PEXELS_API_URL", "https://api.pexels.com/v1/")
+COLLECTION_API = f"{API_URL}collections/"
+QUALITY_VALUES = ["original", "large2x", "large", "medium", "small",
+    "portrait", "landscape", "tiny"]
+MEDIA_VALUES = ["photo_video", "photo", "video"]
+
+# Setup settings.json file
+parent_dir = os.getcwd()
+default_settings = {"pexels_api_key": "", "home": f"{parent_dir}"}
+settings_file = "settings.json"
+
+def load_settings(settings_file, default_settings):
+    """Load settings from settings.json
+    settings_file: string, filename
+    default_settings: dict, default settings for the app
+    """
+    try:
+        with open(settings_file, 'r') as f:
+            settings = jsonload(f)
+    except Exception as e:
+        settings = default_settings
+    return settings
+
+def check_home_dir(settings): # Check Home directory
+    return os.path.exists(str(settings['home']))
+
+def auth_header(settings):
+    return {'Authorization': str(settings["pexels_api_key"])}
+
+def cached_collections(settings):
+    """The collection list from the last list_collections, however old, or None
+    Read straight from the home directory's cache, so the collections show right away while
+    they are revalidated in the background.
+    """
+    if not settings["pexels_api_key"] or not check_home_dir(settings):
+        return None
+    cache = ApiCache(os.path.join(str(settings['home']), CACHE_DIR))
+    entry = cache.get(COLLECTION_API, auth_header(settings))
+    return entry["body"] if entry is not None else None
+
+class CollectionIndex:
+    """Collections keyed by id, plus the unique title each one is listed under
+    Titles shared by several collections get the collection id appended.
+    collections: list of dicts, as returned by list_collections
+    """
+    def __init__(self, collections):
+        self.by_id = {collection['id']: collection for collection in collections}
+        counts = Counter(collection['title'] for collection in collections)
+        self.by_title = {}
+        for collection in collections:
+            title = collection['title']
+            if counts[title] > 1:
+                title = f"{title} ({collection['id']})"
+            self.by_title[title] = collection['id']
+
+    def titles(self):
+        return sorted(self.by_title, key=str.lower)
+
+    def lookup(self, title):
+        return self.by_id[self.by_title[title]]
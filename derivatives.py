@@ -0,0 +1,123 @@
+# Author: Brandon Le
+
+# Smaller photo sizes made locally from a downloaded original instead of downloaded again
+# Pexels builds its src variants from the original with the size parameters in their urls
+# (w, h, dpr, fit=crop), the same sizes are made here with Pillow on a pool of processes.
+
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qs, urlsplit
+
+from downloader import PART_SUFFIX, Cancelled, link_or_copy
+from metrics import recorder
+
+# Constants
+JPEG_QUALITY = 85
+
+def can_derive():
+    """True if Pillow is installed, checked without importing it (see derive_image)"""
+    return importlib.util.find_spec("PIL") is not None
+
+def variant_size(url):
+    """Width, height and crop flag of a Pexels src variant url, width/height are None if not limited"""
+    params = {name: values[0] for name, values in parse_qs(urlsplit(url).query).items()}
+    dpr = float(params.get("dpr", 1))
+    width = round(int(params["w"]) * dpr) if "w" in params else None
+    height = round(int(params["h"]) * dpr) if "h" in params else None
+    return width, height, params.get("fit") == "crop" and width is not None and height is not None
+
+def derive_image(source, file_name, url):
+    """Write the src variant of url to file_name, made from the original photo at source
+    Runs in a worker process. Returns a dict of size/etag/sha256 like download_file.
+    """
+    from PIL import Image, ImageOps # Only the worker processes need Pillow
+    width, height, crop = variant_size(url)
+    if width is None and height is None: # Nothing to resize
+        link_or_copy(source, file_name)
+        with open(file_name, 'rb') as f:
+            data = f.read()
+    else:
+        with Image.open(source) as original:
+            image_format = original.format or "JPEG"
+            image = ImageOps.exif_transpose(original)
+            if crop:
+                image = ImageOps.fit(image, (width, height), Image.LANCZOS)
+            else: # Fit inside the box, never larger than the original
+                image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+            if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            buffer = BytesIO()
+            image.save(buffer, format=image_format, quality=JPEG_QUALITY)
+        data = buffer.getvalue()
+        part_name = file_name + PART_SUFFIX
+        with open(part_name, 'wb') as f:
+            f.write(data)
+        os.replace(part_name, file_name)
+    return {"size": len(data), "etag": None, "sha256": hashlib.sha256(data).hexdigest()}
+
+class Deriver:
+    """Makes the smaller sizes of a job's photos from their originals on a pool of processes
+    The pipeline yields each original's Job before the Jobs derived from it, so a worker
+    holding a derived Job only ever waits for an original that another worker is downloading.
+    processes: int, number of worker processes, defaults to the number of CPUs
+    """
+    def __init__(self, processes=None):
+        if not can_derive():
+            raise ValueError("Making smaller photo sizes needs Pillow, install it with pip install Pillow")
+        self.processes = processes
+        self.pool = None
+        self.originals = {} # media key of an original -> Event set once it is on disk (or failed)
+        self.files = {} # media key of an original -> its file, None if the download failed
+        self.lock = threading.Lock()
+
+    def expect(self, key):
+        """Register an original the pipeline is about to download"""
+        with self.lock:
+            self.originals.setdefault(key, threading.Event())
+
+    def done(self, key, file_name):
+        """An original finished downloading, file_name is None if it failed"""
+        with self.lock:
+            if file_name is not None or key not in self.files: # Keep a copy another collection got
+                self.files[key] = file_name
+            event = self.originals.setdefault(key, threading.Event())
+        event.set()
+
+    def original(self, key, control=None):
+        """File of an original downloaded by this job, waiting for it if it is still downloading
+        Returns None if the original failed or is not part of this job.
+        """
+        with self.lock:
+            event = self.originals.get(key)
+        if event is None:
+            return None
+        while not event.wait(0.1):
+            if control is not None and control.cancelled.is_set():
+                raise Cancelled()
+        return self.files.get(key)
+
+    def derive(self, source, job):
+        """Make the file of a derived Job from the original at source, returns a download_file dict or None"""
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.processes)
+        started = time.perf_counter()
+        info = None
+        try:
+            info = self.pool.submit(derive_image, source, job.file_name, job.url).result()
+        except Exception as e: # Unreadable image, or a worker process died
+            print(f"{e}\tProblem making {job.file_name}")
+        recorder.record("derive", key=job.key, ok=info is not None, bytes=info["size"] if info else 0,
+            seconds=time.perf_counter() - started)
+        return info
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown()
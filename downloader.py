@@ -0,0 +1,467 @@
+# Author: Brandon Le
+
+# Includes code from https://sempioneer.com/python-for-seo/how-to-download-images-in-python/#Method_One_How_To_Download_Multiple_Images_From_A_Python_List
+
+# Concurrent download engine for the Pexels Collection Downloader
+
+import enum
+import hashlib
+import os
+from json import (load as jsonload, dump as jsondump)
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import recorder
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# Classes
+class Media(enum.Enum):
+    photo_video = 0
+    photo = 1
+    video = 2
+
+# Constants
+DEFAULT_JOBS = 8
+CHUNK_SIZE = 64 * 1024
+TIMEOUT = 60
+RETRIES = 3
+RETRY_DELAY = 1 # seconds, multiplied by the attempt number
+PART_SUFFIX = ".part"
+RANGES_SUFFIX = ".ranges" # Saved progress of a ranged transfer, next to its .part file
+RANGE_PARTS = 4 # Connections per large file
+RANGE_MIN_SIZE = 16 * 2**20 # Files from this size on are fetched in ranges
+RANGE_SAVE_EVERY = 8 * 2**20 # Bytes between saves of a ranged transfer's progress
+FICLONE = 0x40049409 # Linux ioctl that clones a file's extents
+# Hosts whose connections a session keeps open, video urls redirect from www.pexels.com to the video host
+POOL_HOSTS = 4
+
+class Cancelled(Exception):
+    """Raised inside a transfer when its JobControl is cancelled"""
+
+class JobControl:
+    """Pause/cancel switch shared by a job's download workers, checked between chunks"""
+    def __init__(self):
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = threading.Event()
+
+    @property
+    def paused(self):
+        return not self.running.is_set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set() # Wake paused workers so they can stop
+
+    def wait(self):
+        """Block while paused, raise Cancelled once cancelled"""
+        self.running.wait()
+        if self.cancelled.is_set():
+            raise Cancelled()
+
+class SessionPool:
+    """Keep-alive HTTP sessions, one per host, shared by all download workers
+    jobs: int, number of download workers
+    parts: int, connections each worker opens for a large file (see fetch_ranges)
+    """
+    def __init__(self, jobs=DEFAULT_JOBS, parts=RANGE_PARTS):
+        self.jobs = jobs
+        self.parts = max(1, parts)
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                # Room for every worker fetching a large file over parts connections
+                adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=self.jobs * self.parts)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[host] = session
+        return session
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class TransferStats:
+    """Timing of one HTTP transfer, recorded as a "transfer" event when the with block ends
+    url: string, url of the transfer
+    fields: extra event fields
+    """
+    def __init__(self, url, **fields):
+        self.fields = {"url": url, "status": None, "ok": False, "ttfb": None, "bytes": 0, "write_seconds": 0.0,
+            **fields}
+        self.started = time.perf_counter()
+        self.recorded = False
+
+    def response(self, r):
+        """The response headers arrived"""
+        self.fields["status"] = r.status_code
+        self.fields["ttfb"] = time.perf_counter() - self.started
+
+    def write(self, f, chunk):
+        started = time.perf_counter()
+        f.write(chunk)
+        self.fields["write_seconds"] += time.perf_counter() - started
+        self.fields["bytes"] += len(chunk)
+
+    def finish(self, ok):
+        if not self.recorded:
+            self.recorded = True
+            self.fields["ok"] = ok
+            recorder.record("transfer", seconds=time.perf_counter() - self.started, **self.fields)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        self.finish(self.fields["ok"] or False)
+
+def media_file_name(url, download_dir, media_type):
+    """Build the local filename for a media url
+    url: string, url of the file
+    download_dir: string, directory to download media to
+    media_type: Media enum, type of media
+    """
+    # We can split the file based upon / and extract the last split
+    if media_type == Media.photo:
+        return download_dir + (url.split('/')[-1]).split("?")[0]
+    return download_dir + url.split('/')[-2] + ".mp4"
+
+def hash_file(file_name, chunk_size=CHUNK_SIZE):
+    """sha256 of the bytes already on disk, used when a partial download is resumed"""
+    sha256 = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+    return sha256
+
+def content_range(headers):
+    """Start and total size from a Content-Range header such as "bytes 100-999/1000" """
+    try:
+        unit, spec = headers["Content-Range"].split(" ", 1)
+        byte_range, total = spec.split("/")
+        start = int(byte_range.split("-")[0])
+        return start, None if total == "*" else int(total)
+    except (KeyError, ValueError):
+        return None, None
+
+def save_ranges(state_name, state):
+    temp_name = state_name + ".tmp"
+    with open(temp_name, 'w') as f:
+        jsondump(state, f)
+    os.replace(temp_name, state_name)
+
+def remove_files(*file_names):
+    for file_name in file_names:
+        try:
+            os.remove(file_name)
+        except FileNotFoundError:
+            pass
+
+def fetch_ranges(sessions, url, part_name, total=None, etag=None, parts=RANGE_PARTS, chunk_size=CHUNK_SIZE,
+        progress=None, control=None, location=None):
+    """Fetch url as byte ranges over parallel connections, written in place into a preallocated part_name
+    Every range is written by its own thread through its own file handle, seeked once to the
+    start of the range. The ranges done so far are saved next to part_name, with total None
+    they are loaded from there and resumed. The file is hashed while it streams: chunks that
+    continue the hashed bytes go into the hash as they arrive, a range that got ahead of the
+    one before it is read back (from the page cache) once that one has caught up. Only those
+    bytes, and the bytes done before a resume, are read twice. Returns and raises like fetch_part.
+    total: int, size of the file, from the Content-Length of the first response
+    etag: string, ETag of the first response, sent as If-Range so a changed file starts over
+    parts: int, number of ranges and connections
+    location: string, url the first response came from after redirects, the ranges are asked for
+        there (and saved with them for a resume) so they skip the redirect
+    """
+    state_name = part_name + RANGES_SUFFIX
+    if total is None:
+        try:
+            with open(state_name, 'r') as f:
+                state = jsonload(f)
+            if os.path.getsize(part_name) != state["total"]:
+                raise ValueError("Partial file does not match its ranges")
+        except (OSError, ValueError, KeyError) as e:
+            remove_files(part_name, state_name)
+            raise requests.HTTPError(f"{e}, restarting")
+    else:
+        size = -(-total // parts)
+        # Each range is [start, end, bytes done], end excluded
+        state = {"total": total, "etag": etag, "url": location or url,
+            "ranges": [[start, min(start + size, total), 0] for start in range(0, total, size)]}
+        with open(part_name, 'wb') as f:
+            f.truncate(total)
+            if hasattr(os, "posix_fallocate"): # Reserve the blocks now rather than fragmenting the file
+                os.posix_fallocate(f.fileno(), 0, total)
+        save_ranges(state_name, state)
+    total, etag, location = state["total"], state["etag"], state.get("url", url)
+    lock = threading.Lock()
+    written = [sum(done for _, _, done in state["ranges"])]
+    saved = [written[0]]
+    restart = threading.Event()
+    sha256 = hashlib.sha256()
+    hashed = [0] # Bytes from the start of the file fed into sha256
+    hash_lock = threading.Lock()
+
+    def hash_through(position=None, chunk=b""):
+        """Feed sha256 up to the first byte not on disk yet, chunk (written at position) from memory
+        Returns right away if another thread is hashing, which then reads the chunk back if needed.
+        """
+        if not hash_lock.acquire(blocking=False):
+            return
+        try:
+            if hashed[0] == position:
+                sha256.update(chunk)
+                hashed[0] += len(chunk)
+            reader = None
+            while True:
+                with lock: # Ranges are consecutive, the first one not done ends the bytes on disk
+                    end = next((start + done for start, stop, done in state["ranges"] if start + done < stop),
+                        total)
+                if hashed[0] >= end:
+                    break
+                if reader is None:
+                    reader = open(part_name, 'rb')
+                    reader.seek(hashed[0])
+                data = reader.read(min(chunk_size, end - hashed[0]))
+                if not data:
+                    break
+                sha256.update(data)
+                hashed[0] += len(data)
+            if reader is not None:
+                reader.close()
+        finally:
+            hash_lock.release()
+
+    def fetch_range(byte_range):
+        start, end, done = byte_range
+        if start + done >= end:
+            return
+        headers = {"Range": f"bytes={start + done}-{end - 1}"}
+        if etag:
+            headers["If-Range"] = etag
+        with TransferStats(url, range=[start + done, end]) as stats, \
+                sessions.get(location).get(location, headers=headers, stream=True, timeout=TIMEOUT) as r:
+            stats.response(r)
+            if r.status_code != 206 or content_range(r.headers) != (start + done, total):
+                if r.status_code < 500: # The file changed or lost range support
+                    restart.set()
+                raise requests.HTTPError(f"Range request answered with {r.status_code}")
+            # Unbuffered, so every byte counted as done has reached the file when the ranges are saved
+            with open(part_name, 'r+b', buffering=0) as f:
+                f.seek(start + done)
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    if control is not None:
+                        control.wait()
+                    chunk = chunk[:end - start - byte_range[2]]
+                    position = start + byte_range[2]
+                    stats.write(f, chunk)
+                    with lock:
+                        byte_range[2] += len(chunk)
+                        written[0] += len(chunk)
+                        if written[0] - saved[0] >= RANGE_SAVE_EVERY:
+                            saved[0] = written[0]
+                            save_ranges(state_name, state)
+                        if progress is not None: # Under the lock, so the counts arrive in order
+                            progress(url, written[0], total)
+                    hash_through(position, chunk)
+            if start + byte_range[2] < end:
+                raise requests.ConnectionError(f"Incomplete range: {byte_range[2]} of {end - start} bytes")
+            stats.finish(True)
+
+    with ThreadPoolExecutor(max_workers=len(state["ranges"])) as pool:
+        futures = [pool.submit(fetch_range, byte_range) for byte_range in state["ranges"]]
+    errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        if restart.is_set():
+            remove_files(part_name, state_name)
+        else: # Keep the ranges done for the next attempt
+            save_ranges(state_name, state)
+        raise next((e for e in errors if isinstance(e, Cancelled)), errors[0])
+    size = os.path.getsize(part_name)
+    if written[0] != total or size != total:
+        remove_files(part_name, state_name)
+        raise requests.ConnectionError(f"Incomplete download: {written[0]} of {total} bytes")
+    hash_through() # Whatever the range threads left, they skip hashing while another one is at it
+    if hashed[0] != total:
+        remove_files(part_name, state_name)
+        raise requests.ConnectionError(f"Hashed {hashed[0]} of {total} bytes")
+    info = {"size": size, "etag": etag, "sha256": sha256.hexdigest()}
+    os.remove(state_name)
+    return info
+
+def fetch_part(sessions, url, part_name, chunk_size=CHUNK_SIZE, progress=None, control=None, parts=RANGE_PARTS,
+        range_min=RANGE_MIN_SIZE):
+    """One attempt at streaming url into part_name, resuming with a Range request if part of it is on disk
+    Files of range_min bytes or more are handed to fetch_ranges when the server supports ranges.
+    Returns a dict of size/etag/sha256, None if the server refused the file, or raises
+    requests.RequestException/OSError when the attempt should be retried.
+    """
+    if os.path.exists(part_name + RANGES_SUFFIX): # An interrupted ranged transfer
+        return fetch_ranges(sessions, url, part_name, parts=parts, chunk_size=chunk_size, progress=progress,
+            control=control)
+    try:
+        offset = os.path.getsize(part_name)
+    except OSError:
+        offset = 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with TransferStats(url, offset=offset) as stats, \
+            sessions.get(url).get(url, headers=headers, stream=True, timeout=TIMEOUT) as r:
+        stats.response(r)
+        if r.status_code == 206:
+            start, total = content_range(r.headers)
+            if start != offset: # The server sent some other range, start over
+                os.remove(part_name)
+                raise requests.HTTPError(f"Unexpected Content-Range {r.headers.get('Content-Range')}")
+            mode = 'ab'
+            sha256 = hash_file(part_name, chunk_size)
+            size = offset
+        elif r.status_code == 200: # No range support, or nothing on disk yet
+            mode = 'wb'
+            sha256 = hashlib.sha256()
+            size = 0
+            total = int(r.headers["Content-Length"]) if "Content-Length" in r.headers else None
+            if parts > 1 and total and total >= range_min and r.headers.get("Accept-Ranges") == "bytes":
+                r.close() # Large file, fetch it over several connections instead
+                stats.finish(True)
+                return fetch_ranges(sessions, url, part_name, total, r.headers.get("ETag"), parts, chunk_size,
+                    progress, control, r.url)
+        elif r.status_code == 416 and offset: # The partial file no longer matches
+            os.remove(part_name)
+            raise requests.HTTPError("Range not satisfiable, restarting")
+        elif r.status_code >= 500:
+            raise requests.HTTPError(f"Server error {r.status_code}")
+        else:
+            return None
+        # Hash while streaming so the file never has to be read back
+        with open(part_name, mode) as f:
+            for chunk in r.iter_content(chunk_size=chunk_size):
+                if control is not None:
+                    control.wait()
+                stats.write(f, chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+                if progress is not None:
+                    progress(url, size, total)
+        if total is not None and size != total:
+            raise requests.ConnectionError(f"Incomplete download: {size} of {total} bytes")
+        stats.finish(True)
+        return {"size": size, "etag": r.headers.get("ETag"), "sha256": sha256.hexdigest()}
+
+def download_file(sessions, url, file_name, chunk_size=CHUNK_SIZE, retries=RETRIES, progress=None,
+        control=None, parts=RANGE_PARTS):
+    """Stream a single url to file_name, returns a dict of size/etag/sha256 or None on failure
+    The data goes to file_name + PART_SUFFIX first and is renamed once complete, so file_name
+    never holds a truncated file. Dropped connections are resumed from the bytes on disk.
+    sessions: SessionPool, pooled sessions to send the request with
+    url: string, url of the file to download
+    file_name: string, path to write the file to
+    chunk_size: int, read buffer size in bytes
+    retries: int, number of times a failed transfer is resumed
+    progress: callable(url, bytes_done, total_bytes), called after every chunk written
+    control: JobControl, pauses the transfer or stops it by raising Cancelled
+    parts: int, connections used for files of RANGE_MIN_SIZE or more, 1 to always use one
+    """
+    part_name = file_name + PART_SUFFIX
+    started = time.perf_counter()
+    info = None
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(RETRY_DELAY * attempt)
+        try:
+            info = fetch_part(sessions, url, part_name, chunk_size, progress, control, parts)
+        except (requests.RequestException, OSError) as e:
+            error = e
+            continue
+        if info is not None:
+            os.replace(part_name, file_name)
+        break
+    else:
+        print(f"{error}\tProblem downloading {url}")
+    recorder.record("download", url=url, ok=info is not None, bytes=info["size"] if info else 0,
+        seconds=time.perf_counter() - started, retries=attempt)
+    return info
+
+def reflink(source, file_name):
+    """Copy-on-write clone of source at file_name (btrfs, XFS), returns False if the filesystem can't"""
+    if fcntl is None:
+        return False
+    try:
+        with open(source, 'rb') as src, open(file_name, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        os.remove(file_name)
+        return False
+
+def link_or_copy(source, file_name):
+    """Put a copy of an already downloaded file at file_name, as a hardlink or reflink when the filesystem allows it"""
+    temp_name = file_name + PART_SUFFIX
+    try:
+        os.remove(temp_name)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(source, temp_name)
+    except OSError: # Other drive, or no hardlink support
+        if not reflink(source, temp_name):
+            shutil.copyfile(source, temp_name)
+    os.replace(temp_name, file_name)
+
+def download_media(urls, download_dir, media_type, jobs=DEFAULT_JOBS, sessions=None):
+    """Download media with a bounded pool of workers
+    urls: list of strings, urls of files to download
+    download_dir: string, directory to download media to
+    media_type: Media enum, type of media
+    jobs: int, maximum number of concurrent downloads
+    sessions: SessionPool, optional pool to share between calls
+    """
+    own_sessions = sessions is None
+    if own_sessions:
+        sessions = SessionPool(jobs)
+
+    def fetch(url):
+        return download_file(sessions, url, media_file_name(url, download_dir, media_type))
+
+    broken_urls = []
+    good_urls = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            # map keeps the results in the same order as urls
+            for url, info in zip(urls, pool.map(fetch, urls)):
+                if info is not None:
+                    good_urls.append(url)
+                else:
+                    broken_urls.append(url)
+    finally:
+        if own_sessions:
+            sessions.close()
+    return broken_urls, good_urls
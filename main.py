@@ -7,14 +7,15 @@
 # Includes code from Jason Yang: https://stackoverflow.com/a/66868963
 
 import PySimpleGUI as sg
-import os
-import requests
-from json import (load as jsonload, dump as jsondump)
-from os import path
-import math
-import enum
-from datetime import datetime
+from json import dump as jsondump
 import webbrowser
+import threading
+import multiprocessing
+# Only light modules here so the window shows right away, the download engine (pexels_dl, with
+# requests and Pillow) is imported where it is first needed, normally by the startup refresh
+from config import (MEDIA_VALUES, QUALITY_VALUES, CollectionIndex, cached_collections, check_home_dir,
+    default_settings, load_settings, settings_file)
+from progress import Progress, describe, format_bytes
 
 # Globals
 # monthly_req_left = 0
@@ -22,29 +23,19 @@ import webbrowser
 api_key_valid = False
 home_dir_valid = False
 
-# Classes
-class Media(enum.Enum):
-    photo_video = 0
-    photo = 1
-    video = 2
-
 # Constants
 THEME = "Black"
-PER_PAGE = 80
-COLLECTION_API = "https://api.pexels.com/v1/collections/"
+PROGRESS_INTERVAL = 0.5 # seconds between progress updates of a running download
+LIST_ROWS = 20 # height of the collection list while it is still loading
 QUALITY_KEYS = ["-QUALITY_ORIGINAL-", "-QUALITY_2X-", "-QUALITY_LARGE-", "-QUALITY_MEDIUM-",
     "-QUALITY_SMALL-", "-QUALITY_PORTRAIT-", "-QUALITY_LANDSCAPE-", "-QUALITY_TINY-"]
-QUALITY_VALUES = ["original", "large2x", "large", "medium", "small",
-    "portrait", "landscape", "tiny"]
 MEDIA_KEYS = ["-MEDIA_ALL-", "-MEDIA_PHOTOS-", "-MEDIA_VIDEOS-"]
-MEDIA_VALUES = ["photo_video", "photo", "video"]
 
 # "Map" from the settings dictionary keys to the window's element keys
 SETTINGS_KEYS_TO_ELEMENT_KEYS = {"pexels_api_key": "-PEXELS_API_KEY-", "home": "-HOME-"}
 
 # Create the directories
 # directories = ["collections_data", "downloads"]
-parent_dir = os.getcwd()
 
 # for i in directories:
 #     path = os.path.join(parent_dir, i)
@@ -54,86 +45,6 @@ parent_dir = os.getcwd()
 #         except OSError as error:
 #             print(error)
 
-# Setup settings.json file
-default_settings = {"pexels_api_key": "", "home": f"{parent_dir}"}
-settings_file = "settings.json"
-
-def check_api_key(settings): # Check API Key
-    auth = {'Authorization': str(settings["pexels_api_key"])}
-    # print(f'settings["pexels_api_key"]: {settings["pexels_api_key"]}')
-    req = requests.get(COLLECTION_API, headers=auth)
-    status = req.status_code
-    if status == 200:
-        print("OK")
-        api_key_valid = True
-        return True
-    elif status == 401 or status == 403:
-        if status == 401:
-            print("Unauthorized")
-        else:
-            print("Forbidden")
-        api_key_valid = False
-    elif status == 429:
-        print("Too many requests")
-    return False
-
-def check_home_dir(settings): # Check Home directory
-    return os.path.exists(str(settings['home']))
-
-def download_media(urls, download_dir, media_type):
-    """Download media
-    urls: list of strings, urls of files to download
-    download_dir: string, directory to download media to
-    media_type: Media enum, type of media
-    """
-    broken_urls = []
-    good_urls = []
-    for media in urls:
-        # We can split the file based upon / and extract the last split within the python list below:
-        if media_type == Media.photo:
-            file_name = download_dir + (media.split('/')[-1]).split("?")[0]
-        else:
-            file_name = download_dir + media.split('/')[-2] + ".mp4"
-        # Now let's send a request to the image URL:
-        r = requests.get(media, stream=True)
-        # We can check that the status code is 200 before doing anything else:
-        if r.status_code == 200:
-            # This command below will allow us to write the data to a file as binary:
-            with open(file_name, 'wb') as f:
-                for chunk in r:
-                    f.write(chunk)
-            good_urls.append(media)
-        else:
-            # We will write all of the images back to the broken_images list:
-            broken_urls.append(media)
-    return broken_urls, good_urls
-
-def get_json(url, auth, total_collections, field):
-    count = 0
-    json = []
-    iterations = 0
-    if total_collections / PER_PAGE < 1:
-        iterations = 1
-    else:
-        iterations = math.ceil(total_collections / PER_PAGE)
-    while count < iterations:
-        req = requests.get(f"{url}?page={count + 1}&per_page={PER_PAGE}", headers=auth)
-        json += req.json()[field]
-        count += 1
-    return json
-
-def load_settings(settings_file, default_settings):
-    """Load settings from settings.json
-    settings_file: string, filename
-    default_settings: dict, default settings for the app
-    """
-    try:
-        with open(settings_file, 'r') as f:
-            settings = jsonload(f)
-    except Exception as e:
-        settings = default_settings
-    return settings
-
 def save_settings(settings_file, settings, values):
     if values:      # if there are stuff specified by another window, fill in those values
         for key in SETTINGS_KEYS_TO_ELEMENT_KEYS:  # update window with the values read from settings file
@@ -175,77 +86,155 @@ def create_main_window(settings):
     def Radio(key, text, group_id, default=False): return sg.Radio(key=key, text=text, group_id=group_id, 
         default=default, enable_events=True)
 
+    def Check(key, text, default=False): return sg.Checkbox(key=key, text=text, default=default,
+        enable_events=True)
+
     def Link(url, text): return sg.Text(key=f'URL {url}', text=text, tooltip=url, enable_events=True)
 
-    auth = {'Authorization': str(settings["pexels_api_key"])}
-    req = requests.get(COLLECTION_API, headers=auth)
-    if req.status_code == 200:
-        total_collections = req.json()["total_results"]
-        collections = get_json(f"{COLLECTION_API}", auth, total_collections, 'collections')
-        # monthly_req_left = req.headers['X-Ratelimit-Remaining']
-        # req_quota_reset = int(req.headers['X-Ratelimit-Reset'])
-
-        left_col = [[sg.Text("Collections")], [sg.HSeparator()],
-                        [sg.Listbox(values=sorted([i['title'] for i in collections], key=str.lower), 
-                            size=(20, total_collections), key='-LIST-', enable_events=True)]]
-        media_opt_panel = [[sg.Text("Media Selection")], [sg.HSeparator()],
-                                [Radio("-MEDIA_ALL-", "Photos and Videos", 2, default=True)],
-                                [Radio("-MEDIA_PHOTOS-", "Photos Only", 2)],
-                                [Radio("-MEDIA_VIDEOS-", "Videos Only", 2)]]
-        # request_panel = [[sg.Text("Hourly request limit: 200")], [sg.HSeparator()],
-        #                     [sg.Text(text="Monthly requests left:")],
-        #                     [sg.Text(key="-REMAINING_REQ-", text=f"{monthly_req_left}")], [sg.HSeparator()],
-        #                     [sg.Text(text="Request quota resets:")],
-        #                     [sg.Text(key="-REQ_QUOTA_RESET-", text=f"{datetime.utcfromtimestamp(req_quota_reset).strftime('%Y-%m-%dT%H:%M')}")]]
-        mid_col = [[sg.Text("Collection Description")], [sg.HSeparator()],
-                    [sg.MLine(size=(20, 10), key='-DESCRIPTION-')]] + [[sg.Text()]] #+ request_panel
-        right_col = media_opt_panel + [[sg.HSeparator()]] + [[sg.Text('Collection Photo Quality')],
-                        [sg.HSeparator()],
-                        [Radio("-QUALITY_ORIGINAL-", "Original", 1, default=True)],
-                        [Radio("-QUALITY_2X-", "Large 2x", 1)],
-                        [Radio("-QUALITY_LARGE-", "Large", 1)],
-                        [Radio("-QUALITY_MEDIUM-", "Medium", 1)],
-                        [Radio("-QUALITY_SMALL-", "Small", 1)],
-                        [Radio("-QUALITY_PORTRAIT-", "Portrait", 1)],
-                        [Radio("-QUALITY_LANDSCAPE-", "Landscape", 1)],
-                        [Radio("-QUALITY_TINY-", "Tiny", 1)]]
-        layout = [[ sg.Column(left_col), sg.VSeparator(), sg.Column(mid_col), sg.VSeparator(), 
-                        sg.Column(right_col)],
-                    [sg.Text('Select download location'), 
-                        sg.InputText(key="-DOWNLOAD_LOCATION-", default_text=str(settings['home']) + "/", 
-                            readonly=True, disabled_readonly_background_color="#4d4d4d",enable_events=True), 
-                        sg.FolderBrowse(key="-DOWNLOAD_BROWSER-", target="-DOWNLOAD_LOCATION-", 
-                            initial_folder=str(settings['home']) + "/")],
-                    [sg.FileBrowse(key="-OUTPUT_VIEWER-", button_text="View Downloads", 
-                        file_types=(("ALL Files", "*.*"), ("JPEG Files", "*.jpeg"), ("MP4 Files", "*.mp4"),),
-                        initial_folder=str(settings['home']) + "/", enable_events=True)],
-                    [sg.MLine(key="-OUTPUT-", size=(74, 5), write_only=True)],
-                    [sg.Button(button_text='Download', key="-DOWNLOAD-", button_color="#66FA9D"), 
-                        sg.Button(button_text='Exit', key="-EXIT-"),
-                        sg.Button(button_text='Change Settings', key="-CHANGE_SETTINGS-")],
-                    [Link('https://github.com/thesamuraiwho', 'Developed by TheSamuraiWho'), 
-                        sg.VSeparator(), 
-                        Link('https://www.pexels.com/', 'Photos provided by Pexels'),
-                        sg.VSeparator(),
-                        sg.Button(button_text='Credits', key="-CREDITS-")]]
-        return sg.Window('Pexels Collection Downloader', layout), collections
-    else:
-        layout = [[sg.popup("Issue with API. Please try again later.", auto_close=True,
-            auto_close_duration=120, any_key_closes=True)]]
-        collections = {}
-        return layout, collections
-   
+    # Show the cached collections right away, the startup refresh revalidates them or fills in
+    # an empty list as the pages arrive
+    collections = cached_collections(settings) or []
+    index = CollectionIndex(collections)
+    total_collections = len(collections)
+
+    left_col = [[sg.Text("Collections"), sg.Button(button_text='Refresh', key="-REFRESH-",
+                        tooltip="Ask the Pexels API again instead of using the cache")], [sg.HSeparator()],
+                    [sg.Listbox(values=index.titles(), size=(20, total_collections or LIST_ROWS), key='-LIST-',
+                        select_mode=sg.LISTBOX_SELECT_MODE_EXTENDED, enable_events=True)]]
+    media_opt_panel = [[sg.Text("Media Selection")], [sg.HSeparator()],
+                            [Radio("-MEDIA_ALL-", "Photos and Videos", 2, default=True)],
+                            [Radio("-MEDIA_PHOTOS-", "Photos Only", 2)],
+                            [Radio("-MEDIA_VIDEOS-", "Videos Only", 2)]]
+    # request_panel = [[sg.Text("Hourly request limit: 200")], [sg.HSeparator()],
+    #                     [sg.Text(text="Monthly requests left:")],
+    #                     [sg.Text(key="-REMAINING_REQ-", text=f"{monthly_req_left}")], [sg.HSeparator()],
+    #                     [sg.Text(text="Request quota resets:")],
+    #                     [sg.Text(key="-REQ_QUOTA_RESET-", text=f"{datetime.utcfromtimestamp(req_quota_reset).strftime('%Y-%m-%dT%H:%M')}")]]
+    mid_col = [[sg.Text("Collection Description")], [sg.HSeparator()],
+                [sg.MLine(size=(20, 10), key='-DESCRIPTION-')]] + [[sg.Text()]] + \
+                [[sg.Text(key="-QUOTA-", text="Loading collections...", size=(40, 1))]] #+ request_panel
+    right_col = media_opt_panel + [[sg.HSeparator()]] + [[sg.Text('Collection Photo Quality')],
+                    [sg.HSeparator()],
+                    [Check("-QUALITY_ORIGINAL-", "Original", default=True)],
+                    [Check("-QUALITY_2X-", "Large 2x")],
+                    [Check("-QUALITY_LARGE-", "Large")],
+                    [Check("-QUALITY_MEDIUM-", "Medium")],
+                    [Check("-QUALITY_SMALL-", "Small")],
+                    [Check("-QUALITY_PORTRAIT-", "Portrait")],
+                    [Check("-QUALITY_LANDSCAPE-", "Landscape")],
+                    [Check("-QUALITY_TINY-", "Tiny")],
+                    [sg.HSeparator()],
+                    [sg.Checkbox('Make smaller sizes from the original', key="-DERIVE-", disabled=True,
+                        tooltip="Faster on a slow connection")]] # Enabled by -ENGINE_READY- if Pillow is installed
+    layout = [[ sg.Column(left_col), sg.VSeparator(), sg.Column(mid_col), sg.VSeparator(), 
+                    sg.Column(right_col)],
+                [sg.Text('Select download location'), 
+                    sg.InputText(key="-DOWNLOAD_LOCATION-", default_text=str(settings['home']) + "/", 
+                        readonly=True, disabled_readonly_background_color="#4d4d4d",enable_events=True), 
+                    sg.FolderBrowse(key="-DOWNLOAD_BROWSER-", target="-DOWNLOAD_LOCATION-", 
+                        initial_folder=str(settings['home']) + "/")],
+                [sg.FileBrowse(key="-OUTPUT_VIEWER-", button_text="View Downloads", 
+                    file_types=(("ALL Files", "*.*"), ("JPEG Files", "*.jpeg"), ("MP4 Files", "*.mp4"),),
+                    initial_folder=str(settings['home']) + "/", enable_events=True)],
+                [sg.MLine(key="-OUTPUT-", size=(74, 5), write_only=True)],
+                [sg.ProgressBar(max_value=1, orientation='h', size=(30, 15), key='-PROGRESS_BAR-'),
+                    sg.Text(key='-PROGRESS_TEXT-', text="", size=(50, 1))],
+                [sg.Text(key='-CURRENT_FILES-', text="", size=(74, 3))],
+                [sg.Checkbox('Skip files already downloaded', key="-SYNC-", default=True),
+                    sg.Checkbox('Delete files removed from the collection', key="-PRUNE-")],
+                [sg.Button(button_text='Download', key="-DOWNLOAD-", button_color="#66FA9D", disabled=True), 
+                    sg.Button(button_text='Pause', key="-PAUSE-", disabled=True),
+                    sg.Button(button_text='Cancel', key="-CANCEL-", disabled=True),
+                    sg.Button(button_text='Exit', key="-EXIT-"),
+                    sg.Button(button_text='Change Settings', key="-CHANGE_SETTINGS-")],
+                [Link('https://github.com/thesamuraiwho', 'Developed by TheSamuraiWho'), 
+                    sg.VSeparator(), 
+                    Link('https://www.pexels.com/', 'Photos provided by Pexels'),
+                    sg.VSeparator(),
+                    sg.Button(button_text='Credits', key="-CREDITS-")]]
+    # Closing the window posts an event instead, so a running job can wind down before Tk goes away
+    return sg.Window('Pexels Collection Downloader', layout, finalize=True,
+        enable_close_attempted_event=True), index
+
+##################### Background jobs #####################
+def refresh_collections(window, settings, refresh=False, incremental=False):
+    """Revalidate the collection list on a worker thread, posting -COLLECTIONS- with the result
+    Loads the download engine first (posting -ENGINE_READY-), and the first page of collections
+    checks the API key on the way. Any error, such as a home folder that is gone or not
+    writable, is posted as -COLLECTIONS_ERROR-.
+    incremental: bool, also post -COLLECTIONS_PAGE- with the collections so far after every page,
+        to fill in a list that had nothing cached
+    """
+    import requests
+    from pexels_dl import iter_collections, open_cache, open_store
+    collections = []
+    try:
+        try:
+            open_cache(settings)
+            open_store(settings)
+        finally: # The engine is loaded either way, don't leave Download disabled
+            window.write_event_value('-ENGINE_READY-', None)
+        for page in iter_collections(settings, refresh):
+            collections += page
+            if incremental:
+                window.write_event_value('-COLLECTIONS_PAGE-', list(collections))
+        window.write_event_value('-COLLECTIONS-', collections)
+    except Exception as e: # Leaving the thread silently would keep "Loading collections..." up for good
+        message = str(e)
+        if isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code in (401, 403):
+            message = "Invalid API key, use Change Settings to enter another one"
+        window.write_event_value('-COLLECTIONS_ERROR-', message)
+
+def start_refresh(window, settings, refresh=False, incremental=False):
+    threading.Thread(target=refresh_collections, args=(window, settings, refresh, incremental),
+        daemon=True).start()
+
+def run_download(window, job, done):
+    """Run a download job on a worker thread, reporting back with window.write_event_value"""
+    from metrics import recorder, report
+    from pexels_dl import API_ERRORS
+    start = recorder.snapshot()
+    try:
+        for result in job:
+            window.write_event_value('-FILE_DONE-', (result.ok, result.job.url, result.job.file_name))
+    except API_ERRORS as e:
+        window.write_event_value('-JOB_ERROR-', str(e))
+    finally:
+        done.set()
+        window.write_event_value('-JOB_DONE-', (job.skipped, job.deleted, job.control.cancelled.is_set(),
+            report(recorder.since(start))))
+
+def report_progress(window, progress, done):
+    """Post a -PROGRESS- snapshot every PROGRESS_INTERVAL seconds until the job is done"""
+    while not done.wait(PROGRESS_INTERVAL):
+        window.write_event_value('-PROGRESS-', progress.snapshot())
+    window.write_event_value('-PROGRESS-', progress.snapshot())
+
+def show_progress(window, snapshot):
+    total = snapshot['total_files'] or max(snapshot['handled'], 1)
+    window['-PROGRESS_BAR-'].update(current_count=snapshot['handled'], max=total)
+    window['-PROGRESS_TEXT-'].update(describe(snapshot))
+    files = []
+    for url, done, size in snapshot['current'][:3]:
+        name = url.split('?')[0].rstrip('/').split('/')[-1]
+        if name == "download": # Video urls end in /<id>/download
+            name = url.split('/')[-2] + ".mp4"
+        files.append(f"{name}: {format_bytes(done)}" + (f" of {format_bytes(size)}" if size else ""))
+    window['-CURRENT_FILES-'].update("\n".join(files))
 
 def main():
     window, settings = None, load_settings(settings_file, default_settings)
-    quality_selection = "original"
+    quality_selection = ["original"]
     media_selection = "photo_video"
+    job_control = None # JobControl of the running download, None when idle
+    job_thread = None
+    refresh_media = False # Set by the Refresh button so the next download skips the cache
 
     while True: # Event Loop
         if window is None:
             if settings == default_settings: # If first time setup, create the settings window
                 window = create_settings_window(settings)
-                api_check = check_api_key(settings)
+                api_check = False # The default settings have no API key, no need to ask the API
                 home_check = check_home_dir(settings)
                 # print(f"api_check: {api_check}\nhome_check: {home_check}")
                 while not api_check or not home_check:
@@ -255,6 +244,7 @@ def main():
                         settings = {"pexels_api_key": f"{values['-PEXELS_API_KEY-']}", "home": f"{values['-HOME-']}"}
 
                     if event == '-SAVE-':
+                        from pexels_dl import check_api_key
                         api_check = check_api_key(settings)
                         home_check = check_home_dir(settings)
                         # print(f"api_check: {api_check}\nhome_check: {home_check}")
@@ -274,68 +264,170 @@ def main():
                     if event.startswith("URL"): # Open URLs if they are clicked
                         url = event.split(" ")[1]
                         webbrowser.open(url)
-            window, collections = create_main_window(settings)
+            window, index = create_main_window(settings)
+            # Fill in the list page by page if nothing was cached, otherwise swap it once revalidated
+            start_refresh(window, settings, incremental=not index.by_id)
 
-        if collections != {}:
+        if index is not None:
             event, values = window.read()
             # print(f"event: {event}")
             # print(f"values: {values}")
             
-            if event in (sg.WIN_CLOSED, '-EXIT-'):
+            if event in (sg.WIN_CLOSED, sg.WINDOW_CLOSE_ATTEMPTED_EVENT, '-EXIT-'):
+                if job_control is not None: # Stop the workers, partial files resume next time
+                    job_control.cancel()
+                    # Keep reading until the job thread posted -JOB_DONE-, its write_event_value
+                    # calls need the event loop, so joining it here would never return
+                    while window.read(timeout=100)[0] not in ('-JOB_DONE-', sg.WIN_CLOSED):
+                        pass
                 break
 
-            if event == '-LIST-': # Select a collection from the listbox
-                selection = [i for i in collections if values['-LIST-'][0] == i['title']][0]
-                window['-OUTPUT-'].print(f"Selecting: {selection['title']}")
-                window['-DESCRIPTION-'].update(f"Title: {selection['title']}\n"
-                                                f"ID: {selection['id']}\n"                                            
-                                                f"Total media count: {selection['media_count']}\n"
-                                                f"Photos count: {selection['photos_count']}\n"
-                                                f"Videos count: {selection['videos_count']}\n"
-                                                f"\nDescription: {selection['description']}\n\n")
+            if event == '-LIST-': # Select collections from the listbox
+                selections = [index.lookup(title) for title in values['-LIST-']]
+                if len(selections) == 1:
+                    selection = selections[0]
+                    window['-OUTPUT-'].print(f"Selecting: {selection['title']}")
+                    window['-DESCRIPTION-'].update(f"Title: {selection['title']}\n"
+                                                    f"ID: {selection['id']}\n"                                            
+                                                    f"Total media count: {selection['media_count']}\n"
+                                                    f"Photos count: {selection['photos_count']}\n"
+                                                    f"Videos count: {selection['videos_count']}\n"
+                                                    f"\nDescription: {selection['description']}\n\n")
+                elif selections:
+                    window['-OUTPUT-'].print(f"Selecting: {len(selections)} collections")
+                    window['-DESCRIPTION-'].update(f"Collections: {len(selections)}\n"
+                                                    f"Total media count: {sum(i['media_count'] for i in selections)}\n"
+                                                    f"Photos count: {sum(i['photos_count'] for i in selections)}\n"
+                                                    f"Videos count: {sum(i['videos_count'] for i in selections)}\n"
+                                                    f"\nEach collection is downloaded to its own folder.\n\n")
+
+            if event == '-REFRESH-': # Reload the collection list from the API
+                window['-OUTPUT-'].print("Refreshing collections...")
+                start_refresh(window, settings, refresh=True)
+                refresh_media = True
+
+            if event == '-ENGINE_READY-': # The download engine finished loading
+                from derivatives import can_derive
+                from pexels_dl import quota_status
+                if job_control is None:
+                    window['-DOWNLOAD-'].update(disabled=False)
+                if can_derive():
+                    window['-DERIVE-'].update(disabled=False)
+                else:
+                    window['-DERIVE-'].set_tooltip("Needs Pillow")
+                window['-QUOTA-'].update(quota_status())
+
+            if event in ('-COLLECTIONS_PAGE-', '-COLLECTIONS-'): # Collections arrived from a background refresh
+                from pexels_dl import quota_status
+                index = CollectionIndex(values[event])
+                window['-LIST-'].update(values=index.titles())
+                # Keep what was selected while the pages came in
+                window['-LIST-'].set_value([title for title in values['-LIST-'] if title in index.by_title])
+                window['-QUOTA-'].update(quota_status())
+
+            if event == '-COLLECTIONS_ERROR-':
+                window['-OUTPUT-'].print(f"Problem refreshing collections: {values['-COLLECTIONS_ERROR-']}")
 
             if event == '-DOWNLOAD_LOCATION-': # Click on download browser button
                 if values['-DOWNLOAD_LOCATION-'][-1] != "/":
                     window['-DOWNLOAD_LOCATION-'].update(values['-DOWNLOAD_LOCATION-'] + "/")
 
             if event == '-DOWNLOAD-': # Click on download button itself
-                if values['-LIST-']:
+                if job_control is not None:
+                    window['-OUTPUT-'].print("A download is already running")
+                elif not quality_selection and media_selection != "video":
+                    window['-OUTPUT-'].print("Select at least one photo quality")
+                elif values['-LIST-']:
+                    from downloader import JobControl, Media
+                    from pexels_dl import plan_job, sync_collection, sync_collections
                     window['-OUTPUT-'].print(f"Downloading...")
-                    auth = {'Authorization': str(settings["pexels_api_key"])}
-                    collection_media = get_json(f"{COLLECTION_API}{selection['id']}", auth, 
-                        selection['media_count'], 'media')
-                    
-                    # Create photos and video lists for download, download, and return successful/failed urls
-                    if media_selection == "photo_video":
-                        photos = [i['src'][quality_selection] for i in collection_media if i['type'] == 'Photo']
-                        videos = ["https://www.pexels.com/video/" + str(i['id']) + "/download" for i in collection_media if i['type'] == 'Video']
-                        window['-OUTPUT-'].print(f"Total photos in {selection['title']}: {len(photos)}")
-                        window['-OUTPUT-'].print(f"Total videos in {selection['title']}: {len(videos)}")
-                        window['-OUTPUT-'].print(f"Total media count in {selection['title']}: {len(photos) + len(videos)}")
-                        broken_photos, good_photos = download_media(photos, values['-DOWNLOAD_LOCATION-'], Media.photo)
-                        window['-OUTPUT-'].print(f"Good photo urls: {good_photos}")
-                        window['-OUTPUT-'].print(f"Broken photo urls: {broken_photos}")
-                        broken_videos, good_videos = download_media(videos, values['-DOWNLOAD_LOCATION-'], Media.video)
-                        window['-OUTPUT-'].print(f"Good video urls: {good_videos}")
-                        window['-OUTPUT-'].print(f"Broken video urls: {broken_videos}")
-                    elif media_selection == "photo":
-                        photos = [i['src'][quality_selection] for i in collection_media if i['type'] == 'Photo']
-                        window['-OUTPUT-'].print(f"Total photos in {selection['title']}: {len(photos)}")
-                        broken_photos, good_photos = download_media(photos, values['-DOWNLOAD_LOCATION-'], Media.photo)
-                        window['-OUTPUT-'].print(f"Good photo urls: {good_photos}")
-                        window['-OUTPUT-'].print(f"Broken photo urls: {broken_photos}")
-                    else:
-                        videos = ["https://www.pexels.com/video/" + str(i['id']) + "/download" for i in collection_media if i['type'] == 'Video']
-                        window['-OUTPUT-'].print(f"Total videos in {selection['title']}: {len(videos)}")
-                        broken_videos, good_videos = download_media(videos, values['-DOWNLOAD_LOCATION-'], Media.video)
-                        window['-OUTPUT-'].print(f"Good video urls: {good_videos}")
-                        window['-OUTPUT-'].print(f"Broken video urls: {broken_videos}")
-            
-            if event in QUALITY_KEYS: # Show photo quality radio selection
-                for i in range(len(QUALITY_KEYS)): # Check the selected quality
-                    if values[QUALITY_KEYS[i]]:
-                        quality_selection = QUALITY_VALUES[i]
-                window['-OUTPUT-'].print(f"Selecting photo quality: {quality_selection}")
+                    selections = [index.lookup(title) for title in values['-LIST-']]
+                    name = selections[0]['title'] if len(selections) == 1 else f"{len(selections)} collections"
+                    media_type = Media[media_selection]
+                    if media_type != Media.video:
+                        total_files = sum(i['photos_count'] for i in selections)
+                        window['-OUTPUT-'].print(f"Total photos in {name}: {total_files}")
+                    if media_type != Media.photo:
+                        total_files = sum(i['videos_count'] for i in selections)
+                        window['-OUTPUT-'].print(f"Total videos in {name}: {total_files}")
+                    if media_type == Media.photo_video:
+                        total_files = sum(i['media_count'] for i in selections)
+                        window['-OUTPUT-'].print(f"Total media count in {name}: {total_files}")
+
+                    window['-OUTPUT-'].print(plan_job(*[i['media_count'] for i in selections]))
+
+                    # One file per photo and selected quality (the original is always kept when deriving)
+                    qualities = set(quality_selection) | ({"original"} if values['-DERIVE-'] else set())
+                    total_files = 0
+                    if media_type != Media.video:
+                        total_files += sum(i['photos_count'] for i in selections) * len(qualities)
+                    if media_type != Media.photo:
+                        total_files += sum(i['videos_count'] for i in selections)
+
+                    # Run the job on background threads so the window keeps responding
+                    progress = Progress(total_files)
+                    job_control = JobControl()
+                    options = dict(media=media_selection, quality=quality_selection, sync=values['-SYNC-'],
+                        prune=values['-PRUNE-'], progress=progress, control=job_control, refresh=refresh_media,
+                        derive=values['-DERIVE-'])
+                    if len(selections) == 1:
+                        job = sync_collection(settings, selections[0]['id'], values['-DOWNLOAD_LOCATION-'],
+                            media_count=selections[0]['media_count'], **options)
+                    else: # One shared job, each collection in its own subdirectory
+                        job = sync_collections(settings, selections, values['-DOWNLOAD_LOCATION-'], **options)
+                    refresh_media = False
+                    done = threading.Event()
+                    job_thread = threading.Thread(target=run_download, args=(window, job, done), daemon=True)
+                    job_thread.start()
+                    threading.Thread(target=report_progress, args=(window, progress, done), daemon=True).start()
+                    window['-DOWNLOAD-'].update(disabled=True)
+                    window['-PAUSE-'].update(text="Pause", disabled=False)
+                    window['-CANCEL-'].update(disabled=False)
+
+            if event == '-PROGRESS-':
+                show_progress(window, values['-PROGRESS-'])
+
+            if event == '-FILE_DONE-':
+                ok, url, file_name = values['-FILE_DONE-']
+                window['-OUTPUT-'].print(f"Downloaded {file_name}" if ok else f"Failed {url}")
+
+            if event == '-JOB_ERROR-':
+                window['-OUTPUT-'].print(f"Problem downloading: {values['-JOB_ERROR-']}")
+
+            if event == '-JOB_DONE-':
+                skipped, deleted, cancelled, summary = values['-JOB_DONE-']
+                if skipped:
+                    window['-OUTPUT-'].print(f"Skipped {skipped} files already downloaded")
+                if deleted:
+                    window['-OUTPUT-'].print(f"Deleted {len(deleted)} files removed from the collection")
+                window['-OUTPUT-'].print("Download cancelled, download again to resume" if cancelled
+                    else "Download finished")
+                if summary:
+                    window['-OUTPUT-'].print(summary)
+                from pexels_dl import quota_status
+                window['-QUOTA-'].update(quota_status())
+                job_thread.join()
+                job_control, job_thread = None, None
+                window['-DOWNLOAD-'].update(disabled=False)
+                window['-PAUSE-'].update(text="Pause", disabled=True)
+                window['-CANCEL-'].update(disabled=True)
+
+            if event == '-PAUSE-' and job_control is not None:
+                if job_control.paused:
+                    job_control.resume()
+                    window['-PAUSE-'].update(text="Pause")
+                else:
+                    job_control.pause()
+                    window['-PAUSE-'].update(text="Resume")
+
+            if event == '-CANCEL-' and job_control is not None:
+                job_control.cancel()
+                window['-CANCEL-'].update(disabled=True)
+
+            if event in QUALITY_KEYS: # Show photo quality checkbox selection
+                # Check the selected qualities, several are downloaded in one pass
+                quality_selection = [QUALITY_VALUES[i] for i in range(len(QUALITY_KEYS)) if values[QUALITY_KEYS[i]]]
+                window['-OUTPUT-'].print(f"Selecting photo quality: {', '.join(quality_selection) or 'none'}")
             
             if event in MEDIA_KEYS: # Show media radio selection
                 for i in range(len(MEDIA_KEYS)): # Check for selected media option
@@ -356,6 +448,7 @@ def main():
                     print(f"event: {settings_event}\nvalues: {settings_values}")
 
                     if settings_event == '-SAVE-':
+                        from pexels_dl import check_api_key
                         api_check = check_api_key(settings)
                         home_check = check_home_dir(settings)
                         # print(f"api_check: {api_check}")
@@ -365,6 +458,9 @@ def main():
                             exit_loop = True
                             settings_window.close()
                             window['-DOWNLOAD_LOCATION-'].update(value=str(settings['home']) + "/")
+                            index = CollectionIndex(cached_collections(settings) or [])
+                            window['-LIST-'].update(values=index.titles())
+                            start_refresh(window, settings, incremental=not index.by_id)
                             window.enable()
                             window.bring_to_front()
 
@@ -397,4 +493,7 @@ def main():
         else:
             exit()
     window.close()
-main()
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support() # Pillow workers of the packaged app start from this file
+    main()
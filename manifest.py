@@ -0,0 +1,148 @@
+# Author: Brandon Le
+
+# Per-collection manifest of downloaded media, used to sync a collection incrementally
+
+import os
+import threading
+from json import (load as jsonload, dump as jsondump)
+
+# Constants
+MANIFEST_FILE = ".pexels-manifest-{}.json"
+JOB_FILE = ".pexels-job-{}.json"
+
+def media_key(media_id, quality):
+    """Manifest key for one variant of a media item, videos use the quality "video"
+    media_id: int, Pexels media id
+    quality: string, photo src variant or "video"
+    """
+    return f"{media_id}:{quality}"
+
+class Manifest:
+    """Index of a collection's downloaded files, stored as json in the download directory
+    Entries are keyed by media_key and hold the url, file name, size, ETag and sha256.
+    download_dir: string, directory the collection is downloaded to
+    collection_id: string, Pexels collection id
+    """
+    def __init__(self, download_dir, collection_id):
+        self.download_dir = download_dir
+        self.path = os.path.join(download_dir, MANIFEST_FILE.format(collection_id))
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, 'r') as f:
+                self.entries = jsonload(f)["media"]
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+
+    def file_path(self, entry):
+        return os.path.join(self.download_dir, entry["file"])
+
+    def is_current(self, key, url):
+        """True if key was downloaded from url and its file is still on disk, checked without any network I/O"""
+        entry = self.entries.get(key)
+        if entry is None or entry["url"] != url:
+            return False
+        try:
+            return os.path.getsize(self.file_path(entry)) == entry["size"]
+        except OSError:
+            return False
+
+    def record(self, key, url, file_name, info):
+        """Add a finished download
+        info: dict, size/etag/sha256 as returned by download_file
+        """
+        self.entries[key] = {"url": url, "file": os.path.relpath(file_name, self.download_dir),
+            "size": info["size"], "etag": info.get("etag"), "sha256": info.get("sha256")}
+        self.dirty = True
+
+    def prune(self, media_ids):
+        """Delete the files of media no longer in the collection, returns the deleted file names
+        media_ids: set of ints, ids of every media item currently in the collection
+        """
+        deleted = []
+        for key, entry in list(self.entries.items()):
+            if int(key.split(":")[0]) in media_ids:
+                continue
+            try:
+                os.remove(self.file_path(entry))
+                deleted.append(entry["file"])
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"{e}\tProblem deleting {entry['file']}")
+                continue
+            del self.entries[key]
+            self.dirty = True
+        return deleted
+
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it half written"""
+        if not self.dirty:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            jsondump({"version": 1, "media": self.entries}, f)
+        os.replace(temp_path, self.path)
+        self.dirty = False
+
+class JobState:
+    """Progress of a collection job, saved in the download directory so the job can resume
+    after a crash or after the request quota ran out. It records the next page to fetch,
+    the Jobs read from earlier pages that have not finished yet, how many have finished and the
+    media ids seen so far.
+    download_dir: string, directory the collection is downloaded to
+    collection_id: string, Pexels collection id
+    options: dict, job settings (media type, qualities), a saved state only resumes if they match
+    """
+    def __init__(self, download_dir, collection_id, options):
+        self.path = os.path.join(download_dir, JOB_FILE.format(collection_id))
+        self.options = options
+        self.next_page = 1
+        self.pending = {}
+        self.finished = 0
+        self.media_ids = set()
+        self.resumed = False
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r') as f:
+                state = jsonload(f)
+        except (OSError, ValueError):
+            return
+        if state.get("options") == options:
+            self.next_page = state["next_page"]
+            self.pending = state["pending"]
+            self.finished = state["finished"]
+            self.media_ids = set(state["media_ids"])
+            self.resumed = True
+
+    def add_page(self, jobs, media_ids):
+        """Mark a page as read
+        jobs: list of [key, job fields] still to download from the page
+        media_ids: iterable of ints, ids of every media item on the page
+        """
+        with self.lock:
+            for key, fields in jobs:
+                self.pending[key] = fields
+            self.media_ids.update(media_ids)
+            self.next_page += 1
+
+    def finish(self, key):
+        with self.lock:
+            self.pending.pop(key, None)
+            self.finished += 1
+
+    def save(self):
+        with self.lock:
+            state = {"options": self.options, "next_page": self.next_page, "pending": self.pending,
+                "finished": self.finished, "media_ids": sorted(self.media_ids)}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            jsondump(state, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        """Delete the saved state once the job completed"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,143 @@
+# Author: Brandon Le
+
+# Timing hooks for API requests, collection pages, downloads and file writes
+# Every hook records an event with recorder.record. Events are totalled per kind for the end of
+# job summary, can be logged as JSON lines and served as Prometheus text for headless runs.
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps as jsondumps
+
+from progress import format_bytes
+
+# Constants
+# Numeric event fields that are added up per kind of event
+SUMMED = ("seconds", "bytes", "ttfb", "write_seconds", "waited", "retries", "cached")
+PROMETHEUS_PREFIX = "pexels_dl"
+
+class Metrics:
+    """Running totals per kind of event, optionally logged to a JSON-lines file
+    An event is a kind (api_request, page, transfer, download, ...) plus fields. The fields
+    in SUMMED are totalled, and events with ok=False are counted as errors.
+    """
+    def __init__(self):
+        self.totals = {} # kind -> count, errors and a total per SUMMED field
+        self.log = None
+        self.lock = threading.Lock()
+
+    def open_log(self, path):
+        """Append every event to path as one json object per line from now on"""
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+            self.log = open(path, 'a', buffering=1) # Line buffered, so a crash loses at most one event
+
+    def close_log(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def record(self, kind, **fields):
+        with self.lock:
+            total = self.totals.setdefault(kind, {"count": 0, "errors": 0})
+            total["count"] += 1
+            if fields.get("ok") is False:
+                total["errors"] += 1
+            for name in SUMMED:
+                if fields.get(name) is not None:
+                    total[name] = total.get(name, 0) + fields[name]
+            if self.log is not None:
+                self.log.write(jsondumps({"time": round(time.time(), 3), "event": kind, **fields}) + "\n")
+
+    def snapshot(self):
+        """Copy of the totals, pass it to since later to get the totals of a single job"""
+        with self.lock:
+            return {kind: dict(total) for kind, total in self.totals.items()}
+
+    def since(self, start):
+        """Totals of the events recorded after the snapshot start"""
+        totals = {}
+        for kind, total in self.snapshot().items():
+            before = start.get(kind, {})
+            totals[kind] = {name: value - before.get(name, 0) for name, value in total.items()}
+        return totals
+
+recorder = Metrics()
+
+def report(totals):
+    """Summary of a job's totals (see Metrics.since), a few lines of text"""
+    def total(kind, name="count"):
+        return totals.get(kind, {}).get(name, 0)
+
+    def average_ms(kind, name):
+        return total(kind, name) / total(kind) * 1000 if total(kind) else 0
+
+    lines = []
+    if total("job"):
+        lines.append(f"Job: {total('job', 'seconds'):.1f}s")
+    if total("api_request"):
+        lines.append(f"API: {total('api_request')} requests ({total('api_request', 'errors')} failed, "
+            f"{total('api_request', 'retries')} retries), {average_ms('api_request', 'seconds'):.0f} ms average, "
+            f"{total('api_request', 'waited'):.1f}s waiting for the request limit")
+    if total("page"):
+        lines.append(f"Pages: {total('page')} read, {total('page', 'cached')} from the cache")
+    if total("download"):
+        seconds = total("transfer", "seconds")
+        rate = total("transfer", "bytes") / seconds if seconds else 0
+        lines.append(f"Downloads: {total('download')} files ({total('download', 'errors')} failed, "
+            f"{total('download', 'retries')} retries), {format_bytes(total('download', 'bytes'))}, "
+            f"{format_bytes(rate)}/s per connection, {average_ms('transfer', 'ttfb'):.0f} ms to first byte")
+        lines.append(f"Disk writes: {total('transfer', 'write_seconds'):.1f}s of {seconds:.1f}s transferring")
+    if total("store_hit") or total("derive"):
+        lines.append(f"Local: {total('store_hit')} files from the store, {total('derive')} sizes made from "
+            f"originals in {total('derive', 'seconds'):.1f}s")
+    return "\n".join(lines)
+
+def prometheus(totals, gauges=None):
+    """Totals (and optional gauges, a dict of name -> number) in the Prometheus text format"""
+    lines = []
+    for name in ("count", "errors") + SUMMED:
+        metric = f"{PROMETHEUS_PREFIX}_{'events' if name == 'count' else name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for kind, total in sorted(totals.items()):
+            if name in total:
+                lines.append(f'{metric}{{event="{kind}"}} {total[name]}')
+    for name, value in sorted((gauges or {}).items()):
+        if value is not None:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """/metrics in the Prometheus text format, /stats as json"""
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        gauges = self.server.gauges() if self.server.gauges is not None else {}
+        if self.path == "/metrics":
+            body = prometheus(recorder.snapshot(), gauges).encode()
+            content_type = "text/plain; version=0.0.4"
+        elif self.path == "/stats":
+            body = jsondumps({"events": recorder.snapshot(), "gauges": gauges}).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_metrics(port, gauges=None, host="127.0.0.1"):
+    """Serve /metrics and /stats on a background thread, returns the server (call shutdown to stop it)
+    gauges: callable returning a dict of name -> number, read on every request
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.gauges = gauges
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
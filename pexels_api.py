@@ -0,0 +1,127 @@
+# Author: Brandon Le
+
+# Pexels API calls: API key check and parallel, scheduled, cached pagination
+
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import COLLECTION_API
+from metrics import recorder
+from scheduler import RateLimitError, RequestScheduler
+
+# Constants
+PER_PAGE = 80
+PAGE_JOBS = 4
+TIMEOUT = 30
+
+scheduler = RequestScheduler()
+cache = None # ApiCache for get_page, set up by pexels_dl.open_cache
+_session = None
+_session_lock = threading.Lock()
+
+def api_session():
+    """Shared keep-alive session for api.pexels.com"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PAGE_JOBS)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+def api_get(url, auth):
+    """Send one API request through the shared session and the request scheduler"""
+    return scheduler.request(api_session(), url, auth, TIMEOUT)
+
+def check_api_key(settings): # Check API Key
+    auth = {'Authorization': str(settings["pexels_api_key"])}
+    try:
+        req = api_get(COLLECTION_API, auth)
+    except (requests.RequestException, RateLimitError) as e:
+        print(e)
+        return False
+    status = req.status_code
+    if status == 200:
+        print("OK")
+        return True
+    elif status == 401 or status == 403:
+        if status == 401:
+            print("Unauthorized")
+        else:
+            print("Forbidden")
+    elif status == 429:
+        print("Too many requests")
+    return False
+
+def page_count(total):
+    """Number of PER_PAGE pages needed for total results"""
+    return max(1, math.ceil(total / PER_PAGE))
+
+def get_page(url, auth, page, refresh=False):
+    """Fetch one page of a paginated endpoint as json, from the cache while it is fresh
+    refresh: bool, ask the API even if the cached page is fresh
+    """
+    page_url = f"{url}?page={page}&per_page={PER_PAGE}"
+    started = time.perf_counter()
+    entry = cache.get(page_url, auth) if cache is not None else None
+    if entry is not None and not refresh and cache.is_fresh(entry):
+        recorder.record("page", url=page_url, cached=1, seconds=time.perf_counter() - started)
+        return entry["body"]
+    headers = dict(auth)
+    if entry is not None and entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    req = api_get(page_url, headers)
+    if req.status_code == 304 and entry is not None:
+        cache.touch(page_url, auth, entry)
+        recorder.record("page", url=page_url, cached=1, seconds=time.perf_counter() - started)
+        return entry["body"]
+    req.raise_for_status()
+    try:
+        body = req.json()
+    except ValueError:
+        raise requests.HTTPError(f"Expected json from {page_url}, got {req.headers.get('Content-Type')}",
+            response=req)
+    if cache is not None:
+        cache.put(page_url, auth, body, req.headers.get("ETag"))
+    recorder.record("page", url=page_url, cached=0, seconds=time.perf_counter() - started)
+    return body
+
+def iter_pages(url, auth, total, field, jobs=PAGE_JOBS, first_page=None, start=1, refresh=False):
+    """Yield the field list of every page in page order, fetching pages ahead in parallel
+    url: string, paginated endpoint
+    auth: dict, authorization header
+    total: int, total number of results (total_results or media_count)
+    field: string, json field holding the results of a page
+    jobs: int, maximum number of pages in flight
+    first_page: dict, json of the start page if the caller already fetched it
+    start: int, page to start from when resuming
+    refresh: bool, bypass fresh cache entries
+    """
+    pages = page_count(total)
+    next_page = start
+    if first_page is not None:
+        yield first_page[field]
+        next_page = start + 1
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        try:
+            while next_page <= pages or pending:
+                # Keep at least one page in flight, the scheduler makes it wait for the quota
+                while next_page <= pages and len(pending) < max(1, scheduler.allowed(jobs)):
+                    pending.append(pool.submit(get_page, url, auth, next_page, refresh))
+                    next_page += 1
+                yield pending.popleft().result()[field]
+        finally:
+            for future in pending:
+                future.cancel()
+
+def estimate_requests(media_count):
+    """API requests a collection job needs: one per page of media"""
+    return page_count(media_count)
@@ -0,0 +1,153 @@
+# Author: Brandon Le
+
+# Importable API for the Pexels Collection Downloader, shared by the GUI (main.py) and
+# the headless command line (cli.py). Importing it opens no window and sends no requests.
+
+import os
+import re
+
+import requests
+
+import pexels_api
+from api_cache import CACHE_DIR, ApiCache
+from blob_store import STORE_DIR, BlobStore
+from config import (COLLECTION_API, MEDIA_VALUES, QUALITY_VALUES, CollectionIndex, auth_header, cached_collections,
+    check_home_dir, default_settings, load_settings, parent_dir, settings_file)
+from derivatives import Deriver
+from downloader import CHUNK_SIZE, DEFAULT_JOBS, RANGE_PARTS, Media
+from pexels_api import RateLimitError, check_api_key, estimate_requests, get_page, iter_pages
+from pipeline import BatchSync, CollectionSync
+
+# Constants
+# Errors a collection listing or download job can end with
+API_ERRORS = (requests.RequestException, ValueError, KeyError, RateLimitError)
+
+# Store of downloaded files shared by all jobs, see open_store
+store = None
+
+def open_cache(settings):
+    """Keep API responses in the home directory's cache folder from now on"""
+    pexels_api.cache = ApiCache(os.path.join(str(settings['home']), CACHE_DIR))
+
+def open_store(settings):
+    """Download through the home directory's blob store from now on, so each file is only downloaded once"""
+    global store
+    directory = os.path.join(str(settings['home']), STORE_DIR)
+    if store is None or store.directory != directory:
+        store = BlobStore(directory)
+
+def iter_collections(settings, refresh=False):
+    """Yield the collections of the account page by page, each page a list of dicts
+    The whole list is cached once the last page arrived, see cached_collections.
+    settings: dict, app settings holding the pexels_api_key
+    refresh: bool, revalidate with the API even if the cached pages are fresh
+    """
+    auth = auth_header(settings)
+    # Page 1 gives the total, the remaining pages are then fetched in parallel
+    first_page = get_page(COLLECTION_API, auth, 1, refresh)
+    collections = []
+    for page in iter_pages(COLLECTION_API, auth, first_page["total_results"], 'collections',
+            first_page=first_page, refresh=refresh):
+        collections += page
+        yield page
+    if pexels_api.cache is not None:
+        pexels_api.cache.put(COLLECTION_API, auth, collections)
+
+def list_collections(settings, refresh=False):
+    """All collections of the account as a list of dicts (id, title, description, media counts)
+    settings: dict, app settings holding the pexels_api_key
+    refresh: bool, revalidate with the API even if the cached pages are fresh
+    """
+    collections = []
+    for page in iter_collections(settings, refresh):
+        collections += page
+    return collections
+
+def collection_dir(download_dir, collection):
+    """Subdirectory of download_dir for one collection of a batch, named after its title"""
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", collection['title']).strip(" .")
+    return os.path.join(download_dir, f"{name or collection['id']} ({collection['id']})")
+
+def quota_status():
+    """Requests left this hour and this month, as far as the scheduler knows"""
+    scheduler = pexels_api.scheduler
+    status = f"Requests left: {scheduler.bucket.available()} this hour"
+    if scheduler.quota.remaining is not None:
+        status += f", {scheduler.quota.remaining} this month"
+    return status
+
+def job_gauges(progress=None):
+    """Current request quota and job progress as numbers, the gauges of the metrics endpoint"""
+    scheduler = pexels_api.scheduler
+    gauges = {"requests_left_hour": scheduler.bucket.available(), "requests_left_month": scheduler.quota.remaining}
+    if progress is not None:
+        snapshot = progress.snapshot()
+        gauges.update({"files_handled": snapshot["handled"], "files_failed": snapshot["files_failed"],
+            "files_total": snapshot["total_files"], "bytes_done": snapshot["bytes_done"],
+            "bytes_per_second": round(snapshot["rate"])})
+    return gauges
+
+def plan_job(*media_counts):
+    """Describe the API cost of downloading collections before the job starts
+    media_counts: ints, number of media items in each collection
+    """
+    needed = sum(estimate_requests(media_count) for media_count in media_counts)
+    wait = pexels_api.scheduler.estimate(needed)
+    if wait is None:
+        return f"This download needs up to {needed} API requests, more than are left this month"
+    plan = f"This download needs up to {needed} API requests"
+    if wait:
+        plan += f", about {wait // 60 + 1} minutes of waiting for the hourly limit"
+    return plan
+
+def sync_collection(settings, collection_id, download_dir, media="photo_video", quality="original",
+        jobs=DEFAULT_JOBS, sync=True, prune=False, media_count=None, progress=None, control=None,
+        refresh=False, derive=False, chunk_size=CHUNK_SIZE, connections=RANGE_PARTS):
+    """Create a download job for a collection, iterate over it to run it
+    Returns a CollectionSync that yields a Result per downloaded file.
+    settings: dict, app settings holding the pexels_api_key
+    collection_id: string, Pexels collection id
+    download_dir: string, directory to download media to, files are linked from the blob store
+        if open_store was called
+    media: string, one of MEDIA_VALUES
+    quality: string or list of strings, photo src variants from QUALITY_VALUES, several are downloaded
+        in one pass, each to its own subdirectory
+    jobs: int, number of concurrent downloads
+    sync: bool, skip media already downloaded
+    prune: bool, delete local files of media removed from the collection
+    media_count: int, number of media items if already known, otherwise read from page 1
+    progress: Progress, optional progress to keep up to date
+    control: JobControl, optional switch to pause or cancel the job
+    refresh: bool, revalidate the collection pages with the API even if cached ones are fresh
+    derive: bool, download only the original photos and make the other qualities from them with
+        Pillow (or a Deriver to share between jobs)
+    chunk_size: int, read buffer size of each transfer in bytes
+    connections: int, connections used for each large file (videos), 1 to use one
+    """
+    if not download_dir.endswith(("/", os.sep)):
+        download_dir += "/"
+    qualities = [quality] if isinstance(quality, str) else list(quality)
+    deriver = derive if isinstance(derive, Deriver) else Deriver() if derive else None
+    return CollectionSync(collection_id, auth_header(settings), media_count, Media[media], qualities,
+        download_dir, sync=sync, prune=prune, workers=jobs, progress=progress, control=control, refresh=refresh,
+        store=store, deriver=deriver, chunk_size=chunk_size, parts=connections)
+
+def sync_collections(settings, collections, download_dir, media="photo_video", quality="original",
+        jobs=DEFAULT_JOBS, sync=True, prune=False, progress=None, control=None, refresh=False, derive=False,
+        chunk_size=CHUNK_SIZE, connections=RANGE_PARTS):
+    """Create one download job for several collections, iterate over it to run it
+    Each collection goes to its own subdirectory of download_dir (see collection_dir), all of
+    them share one worker pool and media found in several collections is downloaded once.
+    collections: list of dicts with the id, title and media_count of each collection
+    The other arguments are the same as for sync_collection.
+    """
+    syncs = []
+    if derive: # One pool of processes for all collections
+        derive = Deriver()
+    for collection in collections:
+        directory = collection_dir(download_dir, collection)
+        os.makedirs(directory, exist_ok=True)
+        syncs.append(sync_collection(settings, collection['id'], directory, media=media, quality=quality,
+            jobs=jobs, sync=sync, prune=prune, media_count=collection['media_count'], progress=progress,
+            control=control, refresh=refresh, derive=derive, chunk_size=chunk_size, connections=connections))
+    return BatchSync(syncs, workers=jobs, progress=progress, control=control)
@@ -0,0 +1,439 @@
+# Author: Brandon Le
+
+# Streaming download pipeline: page fetch -> media filter -> url resolve -> download/write
+# Each stage is a generator or a pool of workers joined by bounded queues, so the first
+# file is written after the first page arrives and memory use does not grow with the
+# size of the collection.
+
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from downloader import (CHUNK_SIZE, DEFAULT_JOBS, RANGE_PARTS, Cancelled, JobControl, Media, SessionPool,
+    download_file, link_or_copy, media_file_name)
+from manifest import JobState, Manifest, media_key
+from metrics import recorder
+from pexels_api import COLLECTION_API, get_page, iter_pages
+
+# Constants
+VIDEO_URL = os.environ.get("PEXELS_VIDEO_URL", "https://www.pexels.com/video/") + "{}/download"
+SAVE_EVERY = 50 # Results between saves of the manifest and job state
+_DONE = object() # End of stream marker passed between stages
+
+# collection is the id of the CollectionSync a Job belongs to, None outside of a sync
+# source is the media key of the original a Job's file is made from instead of downloaded
+Job = namedtuple("Job", "media_type url file_name key collection source", defaults=(None, None))
+
+class Result(namedtuple("Result", "job info")):
+    """A finished Job, info is the download_file dict or None if the download failed"""
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.info is not None
+
+def fetch_media(collection_id, auth, media_count):
+    """Stage 1: yield every media item of a collection, page by page"""
+    for page in iter_pages(f"{COLLECTION_API}{collection_id}", auth, media_count, 'media'):
+        yield from page
+
+def filter_media(items, media_type):
+    """Stage 2: keep only the items of the selected Media type"""
+    for item in items:
+        if media_type == Media.photo_video:
+            yield item
+        elif media_type == Media.photo and item['type'] == 'Photo':
+            yield item
+        elif media_type == Media.video and item['type'] == 'Video':
+            yield item
+
+def resolve_urls(items, qualities, download_dir, derive=False):
+    """Stage 3: turn media items into download Jobs, one per photo quality
+    qualities: list of strings, photo src variants from QUALITY_VALUES, each one goes to its own
+        subdirectory of download_dir when there are several
+    derive: bool, make the photo qualities other than "original" from the original (see Deriver),
+        the original has to come first in qualities
+    """
+    for item in items:
+        if item['type'] == 'Photo':
+            for quality in qualities:
+                url = item['src'][quality]
+                directory = os.path.join(download_dir, quality, "") if len(qualities) > 1 else download_dir
+                source = media_key(item['id'], "original") if derive and quality != "original" else None
+                yield Job(Media.photo, url, media_file_name(url, directory, Media.photo),
+                    media_key(item['id'], quality), source=source)
+        else:
+            url = VIDEO_URL.format(item['id'])
+            yield Job(Media.video, url, media_file_name(url, download_dir, Media.video),
+                media_key(item['id'], "video"))
+
+def _put(q, item, stop):
+    """Put that gives up once the pipeline is stopped"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def fetch_job(sessions, job, progress=None, control=None, **options):
+    """Default download stage: stream the Job's url to its file, returns the download_file dict or None
+    options: passed on to download_file (chunk_size, parts)
+    """
+    return download_file(sessions, job.url, job.file_name, progress=progress, control=control, **options)
+
+def run_pipeline(jobs, workers=DEFAULT_JOBS, queue_size=None, sessions=None, progress=None, control=None,
+        fetch=fetch_job, parts=RANGE_PARTS):
+    """Stage 4: download Jobs on a pool of workers, yield a Result as each file is written
+    jobs: iterable of Job, usually from CollectionSync.page_jobs
+    workers: int, number of concurrent downloads
+    queue_size: int, maximum number of Jobs waiting for a worker
+    sessions: SessionPool, optional pool to share between pipelines
+    progress: Progress, receives the byte counts of every transfer
+    control: JobControl, pauses the workers or stops the pipeline early
+    fetch: callable(sessions, job, progress, control), the download stage run by the workers
+    parts: int, connections fetch uses for each large file, sizes the SessionPool if none is given
+    """
+    workers = max(1, workers)
+    job_queue = queue.Queue(maxsize=queue_size or 2 * workers)
+    result_queue = queue.Queue(maxsize=2 * workers)
+    stop = threading.Event()
+    errors = []
+    own_sessions = sessions is None
+    if own_sessions:
+        sessions = SessionPool(workers, parts)
+
+    def produce():
+        try:
+            for job in jobs:
+                # Blocks while the workers are busy, which also pauses the page fetching
+                if not _put(job_queue, job, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                _put(job_queue, _DONE, stop)
+
+    def work():
+        try:
+            while not stop.is_set():
+                try:
+                    job = job_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if job is _DONE or (control is not None and control.cancelled.is_set()):
+                    break
+                try:
+                    info = fetch(sessions, job, progress.update if progress is not None else None, control)
+                except Cancelled: # The partial file stays on disk for the next run to resume
+                    break
+                except Exception as e: # Say an unwritable folder, fail the Job rather than the worker
+                    print(f"{e}\tProblem downloading {job.url}")
+                    info = None
+                if not _put(result_queue, Result(job, info), stop):
+                    break
+        finally: # The consumer waits for a _DONE from every worker
+            _put(result_queue, _DONE, stop)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    try:
+        running = workers
+        while running:
+            result = result_queue.get()
+            if result is _DONE:
+                running -= 1
+            else:
+                yield result
+        if errors:
+            raise errors[0]
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if own_sessions:
+            sessions.close()
+
+class CollectionSync:
+    """Download a collection through the pipeline, keeping its Manifest and JobState up to date
+    Iterating yields a Result for every file downloaded. Afterwards skipped holds the number
+    of files already up to date and deleted the files removed because they left the collection.
+    An interrupted job (crash, closed window, quota used up) resumes where it stopped the next
+    time the same collection is downloaded with the same media type and quality.
+    collection_id: string, Pexels collection id
+    auth: dict, authorization header
+    media_count: int, number of media items in the collection, None to read it from the first page
+    media_type: Media enum, type of media
+    qualities: list of strings, photo src variants from QUALITY_VALUES, all downloaded in one pass
+    download_dir: string, directory to download media to
+    sync: bool, skip media the manifest shows is already downloaded
+    prune: bool, delete local files of media removed from the collection
+    workers: int, number of concurrent downloads
+    progress: Progress, optional progress to keep up to date
+    control: JobControl, optional switch to pause or cancel the job
+    refresh: bool, revalidate cached collection pages with the API
+    store: BlobStore, optional store to download through and link the files from
+    deriver: Deriver, download only the original photos and make the other qualities from them
+    chunk_size: int, read buffer size of each transfer in bytes
+    parts: int, connections used for each large file
+    """
+    def __init__(self, collection_id, auth, media_count, media_type, qualities, download_dir,
+            sync=True, prune=False, workers=DEFAULT_JOBS, progress=None, control=None, refresh=False,
+            store=None, deriver=None, chunk_size=CHUNK_SIZE, parts=RANGE_PARTS):
+        self.collection_id = collection_id
+        self.auth = auth
+        self.media_count = media_count
+        self.media_type = media_type
+        if deriver is not None: # Every other quality is made from the original, so get it first
+            qualities = ["original"] + [quality for quality in qualities if quality != "original"]
+        self.qualities = qualities
+        self.download_dir = download_dir
+        self.sync = sync
+        self.prune = prune
+        self.workers = workers
+        self.progress = progress
+        self.control = control or JobControl()
+        self.refresh = refresh
+        self.store = store
+        self.deriver = deriver
+        self.transfer = {"chunk_size": chunk_size, "parts": parts} # download_file options
+        if len(qualities) > 1 and media_type != Media.video:
+            for quality in qualities:
+                os.makedirs(os.path.join(download_dir, quality), exist_ok=True)
+        self.manifest = Manifest(download_dir, collection_id)
+        options = {"media": media_type.name, "quality": ",".join(qualities)}
+        if deriver is not None:
+            options["derive"] = True
+        self.state = JobState(download_dir, collection_id, options)
+        self.skipped = 0
+        self.deleted = []
+        self.handled = 0
+        self.failed = 0
+        if self.progress is not None and self.state.resumed: # Count the files done before the interruption
+            self.progress.skip(self.state.finished)
+
+    def skip_current(self, jobs):
+        """Stage between url resolve and download: drop Jobs already on disk, no network I/O"""
+        for job in jobs:
+            if self.sync and self.manifest.is_current(job.key, job.url):
+                self.skipped += 1
+                self.state.finish(job.key)
+                if self.progress is not None:
+                    self.progress.skip()
+                continue
+            if self.deriver is not None and job.key.endswith(":original"):
+                self.deriver.expect(job.key)
+            yield job
+
+    def page_jobs(self):
+        """Stages 1-3 page by page, recording every page read in the JobState"""
+        # Jobs left over from an interrupted run go first
+        leftover = [Job(Media[fields[0]], *fields[1:3], key, self.collection_id, *fields[3:])
+            for key, fields in list(self.state.pending.items())]
+        yield from self.skip_current(leftover)
+        url = f"{COLLECTION_API}{self.collection_id}"
+        first_page = None
+        if self.media_count is None: # The first page read also gives the total
+            first_page = get_page(url, self.auth, self.state.next_page, self.refresh)
+            self.media_count = first_page['total_results']
+        pages = iter_pages(url, self.auth, self.media_count, 'media', first_page=first_page,
+            start=self.state.next_page, refresh=self.refresh)
+        for page in pages:
+            items = filter_media(page, self.media_type)
+            jobs = resolve_urls(items, self.qualities, self.download_dir, derive=self.deriver is not None)
+            jobs = [job._replace(collection=self.collection_id) for job in self.skip_current(jobs)]
+            self.state.add_page([(job.key, [job.media_type.name, job.url, job.file_name, job.source])
+                for job in jobs], [item['id'] for item in page])
+            yield from jobs
+
+    def download(self, sessions, job, progress=None, control=None):
+        """Download a Job's file, through the BlobStore if there is one"""
+        if self.store is None:
+            return fetch_job(sessions, job, progress, control, **self.transfer)
+        # A full download (sync off) fetches every file again instead of trusting the store
+        return self.store.fetch(sessions, job, progress, control, refresh=not self.sync, **self.transfer)
+
+    def fetch(self, sessions, job, progress=None, control=None, download=None):
+        """Download stage: make a derived Job's file from its original, download any other Job
+        download: callable, replaces self.download, used by BatchSync
+        """
+        download = download or self.download
+        if job.source is not None:
+            source = self.deriver.original(job.source, control)
+            entry = self.manifest.entries.get(job.source)
+            if source is None and entry is not None and self.manifest.is_current(job.source, entry["url"]):
+                source = self.manifest.file_path(entry) # Downloaded by an earlier job
+            return self.deriver.derive(source, job) if source is not None else None
+        if self.deriver is None or not job.key.endswith(":original"):
+            return download(sessions, job, progress, control)
+        info = None
+        try:
+            info = download(sessions, job, progress, control)
+        finally: # Wake the workers waiting to make the other qualities
+            self.deriver.done(job.key, job.file_name if info is not None else None)
+        return info
+
+    def save(self):
+        self.manifest.save()
+        self.state.save()
+        if self.store is not None:
+            self.store.save()
+
+    def handle(self, result):
+        """Record a finished Result of one of this collection's Jobs"""
+        if self.progress is not None:
+            self.progress.finish(result)
+        if result.ok:
+            self.manifest.record(result.job.key, result.job.url, result.job.file_name, result.info)
+        else:
+            self.failed += 1
+        self.state.finish(result.job.key)
+        self.handled += 1
+        if self.handled % SAVE_EVERY == 0:
+            self.save()
+
+    def close(self, complete):
+        """Save the manifest, and either finish the job or keep its state for resuming
+        complete: bool, every page was read and every Job finished
+        """
+        try:
+            # Only prune once every page was read, otherwise media_ids is incomplete
+            if complete and self.prune:
+                self.deleted = self.manifest.prune(self.state.media_ids)
+        finally:
+            self.manifest.save()
+            if self.store is not None:
+                self.store.save()
+            if complete:
+                self.state.remove()
+            else:
+                self.state.save()
+
+    def __iter__(self):
+        complete = False
+        started = time.perf_counter()
+        try:
+            results = run_pipeline(self.page_jobs(), self.workers, progress=self.progress, control=self.control,
+                fetch=self.fetch, parts=self.transfer["parts"])
+            for result in results:
+                self.handle(result)
+                yield result
+            complete = not self.control.cancelled.is_set()
+        finally:
+            if self.deriver is not None:
+                self.deriver.close()
+            self.close(complete)
+            recorder.record("job", collections=[self.collection_id], ok=complete,
+                seconds=time.perf_counter() - started, files=self.handled, failed=self.failed,
+                skipped=self.skipped)
+
+class BatchSync:
+    """Download several collections as one job
+    All collections share one worker pool and one connection pool, and run smallest first so
+    most of them finish early when the request quota is tight. Media found in more than one
+    collection is downloaded once and linked (or copied) into the other collection folders,
+    by the syncs' BlobStore if they have one.
+    Iterating yields a Result for every file, like CollectionSync.
+    syncs: list of CollectionSync, one per collection, each with its own download directory
+    workers: int, number of concurrent downloads
+    progress: Progress, optional progress shared by all collections
+    control: JobControl, optional switch to pause or cancel the job
+    """
+    def __init__(self, syncs, workers=DEFAULT_JOBS, progress=None, control=None):
+        self.syncs = sorted(syncs, key=lambda sync: sync.media_count or 0)
+        self.by_id = {sync.collection_id: sync for sync in syncs}
+        self.workers = workers
+        self.progress = progress
+        self.control = control or JobControl()
+        self.files = {} # media key -> (file_name, info) of the first finished download
+        self.inflight = {} # media key -> Event set once its first download finished
+        self.lock = threading.Lock()
+
+    @property
+    def skipped(self):
+        return sum(sync.skipped for sync in self.syncs)
+
+    @property
+    def deleted(self):
+        return [name for sync in self.syncs for name in sync.deleted]
+
+    def page_jobs(self):
+        for sync in self.syncs:
+            yield from sync.page_jobs()
+
+    def local_copy(self, key, manifests=True):
+        """A finished file for key from this job or from any collection's manifest, or None
+        manifests: bool, also look in the manifests, off for a full download (sync off)
+        """
+        if key in self.files:
+            return self.files[key]
+        if not manifests:
+            return None
+        for sync in self.syncs:
+            entry = sync.manifest.entries.get(key)
+            if entry is not None and sync.manifest.is_current(key, entry["url"]):
+                return sync.manifest.file_path(entry), entry
+        return None
+
+    def fetch(self, sessions, job, progress=None, control=None):
+        """Download stage of the collection the Job belongs to, with download replaced by self.download"""
+        return self.by_id[job.collection].fetch(sessions, job, progress, control, download=self.download)
+
+    def download(self, sessions, job, progress=None, control=None):
+        """Download each media key once and link the other copies"""
+        sync = self.by_id[job.collection]
+        if sync.store is not None: # The store already downloads each key once
+            return sync.download(sessions, job, progress, control)
+        with self.lock:
+            source = self.local_copy(job.key, sync.sync)
+            event = self.inflight.get(job.key)
+            first = source is None and event is None
+            if first:
+                event = self.inflight[job.key] = threading.Event()
+        if first:
+            info = None
+            try:
+                info = fetch_job(sessions, job, progress, control, **sync.transfer)
+            finally:
+                with self.lock:
+                    if info is not None:
+                        self.files[job.key] = (job.file_name, info)
+                    del self.inflight[job.key]
+                event.set()
+            return info
+        if source is None: # Another worker is downloading it, wait and link its file
+            event.wait()
+            with self.lock:
+                source = self.local_copy(job.key, sync.sync)
+            if source is None: # That download failed, try it ourselves
+                return fetch_job(sessions, job, progress, control, **sync.transfer)
+        file_name, info = source
+        if os.path.abspath(file_name) != os.path.abspath(job.file_name):
+            link_or_copy(file_name, job.file_name)
+        return {"size": info["size"], "etag": info.get("etag"), "sha256": info.get("sha256")}
+
+    def __iter__(self):
+        complete = False
+        started = time.perf_counter()
+        try:
+            parts = max((sync.transfer["parts"] for sync in self.syncs), default=RANGE_PARTS)
+            results = run_pipeline(self.page_jobs(), self.workers, progress=self.progress, control=self.control,
+                fetch=self.fetch, parts=parts)
+            for result in results:
+                self.by_id[result.job.collection].handle(result)
+                yield result
+            complete = not self.control.cancelled.is_set()
+        finally:
+            for sync in self.syncs:
+                if sync.deriver is not None:
+                    sync.deriver.close()
+                sync.close(complete)
+            recorder.record("job", collections=list(self.by_id), ok=complete,
+                seconds=time.perf_counter() - started, files=sum(sync.handled for sync in self.syncs),
+                failed=sum(sync.failed for sync in self.syncs), skipped=self.skipped)
@@ -0,0 +1,89 @@
+# Author: Brandon Le
+
+# Job progress shared between the download workers and whoever displays it (GUI or CLI)
+
+import threading
+import time
+from collections import deque
+
+# Constants
+RATE_WINDOW = 5 # seconds of transfer history used for the bytes/sec rate
+
+def format_bytes(count):
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024:
+            return f"{count:.0f} {unit}" if unit == "B" else f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes:02}:{seconds:02}"
+
+class Progress:
+    """Per-file and aggregate progress of a download job
+    Workers call update after each chunk and the job calls finish/skip per file, from any
+    thread. snapshot returns a plain dict that is safe to pass to another thread.
+    total_files: int, number of files the job will handle, if known
+    """
+    def __init__(self, total_files=None):
+        self.total_files = total_files
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.bytes_done = 0
+        self.current = {} # url -> [bytes_done, total_bytes]
+        self.samples = deque() # (time, bytes_done) for the rate
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, url, done, total):
+        """Progress hook for download_file"""
+        with self.lock:
+            previous = self.current.get(url, [0, None])[0]
+            # A resumed or restarted transfer can report fewer bytes than before
+            self.bytes_done += max(0, done - previous)
+            self.current[url] = [done, total]
+
+    def skip(self, count=1):
+        with self.lock:
+            self.files_skipped += count
+
+    def finish(self, result):
+        """Count a finished pipeline Result"""
+        with self.lock:
+            self.current.pop(result.job.url, None)
+            if result.ok:
+                self.files_done += 1
+            else:
+                self.files_failed += 1
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, self.bytes_done))
+            while len(self.samples) > 2 and now - self.samples[0][0] > RATE_WINDOW:
+                self.samples.popleft()
+            first_time, first_bytes = self.samples[0]
+            rate = (self.bytes_done - first_bytes) / (now - first_time) if now > first_time else 0
+            handled = self.files_done + self.files_failed + self.files_skipped
+            eta = None
+            finished = self.files_done + self.files_failed
+            if self.total_files and finished:
+                # Files still to go at the average pace of the files finished so far
+                eta = max(0, self.total_files - handled) * (now - self.start) / finished
+            return {"files_done": self.files_done, "files_failed": self.files_failed,
+                "files_skipped": self.files_skipped, "total_files": self.total_files,
+                "handled": handled, "bytes_done": self.bytes_done, "rate": rate, "eta": eta,
+                "elapsed": now - self.start,
+                "current": [(url, done, total) for url, (done, total) in self.current.items()]}
+
+def describe(snapshot):
+    """One line summary of a Progress snapshot"""
+    total = snapshot["total_files"] or "?"
+    return (f"{snapshot['handled']}/{total} files, {snapshot['files_failed']} failed, "
+        f"{format_bytes(snapshot['bytes_done'])} at {format_bytes(snapshot['rate'])}/s, "
+        f"ETA {format_eta(snapshot['eta'])}")
@@ -0,0 +1,196 @@
+# Author: Brandon Le
+
+# Request-budget scheduler: every Pexels API request goes through one token bucket that
+# keeps us inside the hourly limit, tracks the monthly quota from the response headers and
+# retries 429/5xx responses with backoff and jitter.
+
+import math
+import random
+import threading
+import time
+
+import requests
+
+from metrics import recorder
+
+# Constants
+HOURLY_LIMIT = 200 # Pexels default, requests per hour
+RETRIES = 4
+BACKOFF = 2 # seconds, doubled on every retry
+MAX_BACKOFF = 60
+WAIT_NOTICE = 5 # print a notice when a request has to wait longer than this many seconds
+
+class RateLimitError(Exception):
+    """Raised when the Pexels request quota is used up
+    reset: int, unix timestamp of when the quota resets, or None if unknown
+    """
+    def __init__(self, reset=None):
+        self.reset = reset
+        if reset:
+            when = time.strftime('%Y-%m-%dT%H:%M', time.localtime(reset))
+            super().__init__(f"Pexels request quota used up, resets at {when}")
+        else:
+            super().__init__("Pexels request quota used up")
+
+class RateLimit:
+    """Monthly request quota tracked from the X-Ratelimit-* response headers"""
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.lock = threading.Lock()
+
+    def update(self, headers):
+        try:
+            limit = int(headers['X-Ratelimit-Limit'])
+            remaining = int(headers['X-Ratelimit-Remaining'])
+            reset = int(headers['X-Ratelimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            # Responses to parallel requests arrive out of order, so within one quota
+            # period only ever move the remaining count down
+            if self.reset == reset and self.remaining is not None:
+                remaining = min(remaining, self.remaining)
+            self.limit, self.remaining, self.reset = limit, remaining, reset
+
+    def acquire(self):
+        """Count a request about to be sent, returns False if the quota is used up"""
+        with self.lock:
+            if self.remaining is None:
+                return True
+            if self.remaining <= 0 and self.reset and time.time() >= self.reset:
+                self.remaining = None # A new quota period started, wait for fresh headers
+                return True
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def release(self):
+        """Give back a request counted by acquire that was not sent"""
+        with self.lock:
+            if self.remaining is not None:
+                self.remaining += 1
+
+class TokenBucket:
+    """Token bucket holding up to capacity tokens, refilled at rate tokens per second"""
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Take a token if one is available, otherwise return the seconds until there is one"""
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def available(self):
+        with self.lock:
+            self._refill()
+            return int(self.tokens)
+
+    def drain(self):
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+class RequestScheduler:
+    """Central gate for every Pexels API request
+    Requests wait for a token from the hourly bucket, fail with RateLimitError once the monthly
+    quota is used up and are retried with exponential backoff and jitter on 429, 5xx and
+    connection errors.
+    hourly_limit: int, requests allowed per hour
+    retries: int, times a failed request is retried
+    """
+    def __init__(self, hourly_limit=HOURLY_LIMIT, retries=RETRIES):
+        self.bucket = TokenBucket(hourly_limit, hourly_limit / 3600)
+        self.quota = RateLimit()
+        self.retries = retries
+
+    def allowed(self, wanted):
+        """How many of wanted requests can be sent right now without waiting"""
+        available = self.bucket.available()
+        if self.quota.remaining is not None:
+            available = min(available, self.quota.remaining)
+        return max(0, min(wanted, available))
+
+    def acquire(self):
+        """Block until a request may be sent, returns the seconds waited"""
+        noticed = False
+        waited = 0
+        while True:
+            if not self.quota.acquire():
+                raise RateLimitError(self.quota.reset)
+            wait = self.bucket.take()
+            if not wait:
+                return waited
+            self.quota.release() # Not sent yet
+            if wait > WAIT_NOTICE and not noticed:
+                print(f"Waiting {wait:.0f}s for the hourly request limit")
+                noticed = True
+            time.sleep(wait)
+            waited += wait
+
+    def backoff(self, attempt, req=None):
+        """Seconds to wait before retry number attempt, honouring Retry-After"""
+        if req is not None and "Retry-After" in req.headers:
+            try:
+                return min(MAX_BACKOFF, float(req.headers["Retry-After"]))
+            except ValueError:
+                pass
+        delay = min(MAX_BACKOFF, BACKOFF * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2) # Jitter keeps parallel workers apart
+
+    def request(self, session, url, headers, timeout):
+        """Send a GET request through the scheduler, returns the final response
+        Records an api_request event with the time spent, waits and retries.
+        """
+        started = time.perf_counter()
+        event = {"url": url, "status": None, "waited": 0, "retries": 0, "ttfb": None}
+        try:
+            for attempt in range(self.retries + 1):
+                event["retries"] = attempt
+                event["waited"] += self.acquire()
+                try:
+                    req = session.get(url, headers=headers, timeout=timeout)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt == self.retries:
+                        raise
+                    time.sleep(self.backoff(attempt))
+                    continue
+                event["status"] = req.status_code
+                event["ttfb"] = req.elapsed.total_seconds()
+                self.quota.update(req.headers)
+                if req.status_code == 429:
+                    self.bucket.drain() # The API disagrees with our count, slow down
+                    # Only the headers tell a used up month from a burst over the hourly limit
+                    if req.headers.get('X-Ratelimit-Remaining') == "0":
+                        raise RateLimitError(self.quota.reset)
+                elif req.status_code < 500:
+                    return req
+                if attempt == self.retries:
+                    return req # Still refused, the caller sees the 429 or 5xx
+                time.sleep(self.backoff(attempt, req))
+        finally:
+            status = event["status"]
+            recorder.record("api_request", ok=status is not None and status < 400,
+                seconds=time.perf_counter() - started, **event)
+
+    def estimate(self, requests_needed):
+        """Seconds until requests_needed requests can have been sent, or None if the monthly quota is too small"""
+        if self.quota.remaining is not None and requests_needed > self.quota.remaining:
+            return None
+        missing = requests_needed - self.bucket.available()
+        return max(0, math.ceil(missing / self.bucket.rate))
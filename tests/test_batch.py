@@ -0,0 +1,76 @@
+# Author: Brandon Le
+
+# BatchSync against the mock Pexels API: media shared by several collections is downloaded once
+# Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import downloader
+import pexels_api
+import pipeline
+from mock_pexels import API_KEY, MockPexels
+from scheduler import RequestScheduler
+
+def shared_collections():
+    """Two collections of ten photos, five of them in both"""
+    photos = [{"id": 1000000 + number, "type": "Photo"} for number in range(15)]
+    return [{"id": "mock00000", "title": "First", "media": photos[:10]},
+        {"id": "mock00001", "title": "Second", "media": photos[5:]}]
+
+class BatchSyncTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.mock = MockPexels(shared_collections(), photo_size=4096)
+        self.mock.__enter__()
+        self.addCleanup(self.mock.__exit__)
+        api_url = f"{self.mock.url}/v1/collections/"
+        for patcher in (mock.patch.object(pipeline, "COLLECTION_API", api_url),
+                mock.patch.object(pexels_api, "COLLECTION_API", api_url), mock.patch.object(pexels_api, "cache", None),
+                mock.patch.object(pexels_api, "scheduler", RequestScheduler())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_batch(self, sync):
+        """Run a batch job over both collections, returns its Results and the files it downloaded"""
+        syncs = [pipeline.CollectionSync(collection_id, {"Authorization": API_KEY}, 10, downloader.Media.photo,
+            ["original"], os.path.join(self.dir, collection_id) + "/", sync=sync, workers=4)
+            for collection_id in ("mock00000", "mock00001")]
+        for collection_sync in syncs:
+            os.makedirs(collection_sync.download_dir, exist_ok=True)
+        with mock.patch.object(pipeline, "fetch_job", wraps=pipeline.fetch_job) as fetch_job:
+            results = list(pipeline.BatchSync(syncs, workers=4))
+        return results, fetch_job.call_count
+
+    def photos(self, collection_id):
+        return sorted(name for name in os.listdir(os.path.join(self.dir, collection_id)) if name.endswith(".jpeg"))
+
+    def test_shared_media_downloaded_once(self):
+        results, downloads = self.run_batch(sync=True)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(downloads, 15) # The five shared photos are linked into the second folder
+        self.assertEqual(len(self.photos("mock00000")), 10)
+        self.assertEqual(len(self.photos("mock00001")), 10)
+
+        results, downloads = self.run_batch(sync=True)
+        self.assertEqual((len(results), downloads), (0, 0)) # Everything is on disk already
+
+    def test_full_download_fetches_again(self):
+        self.run_batch(sync=True)
+        results, downloads = self.run_batch(sync=False)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(downloads, 15) # Not taken from the manifests, still once per photo
+
+if __name__ == "__main__":
+    unittest.main()
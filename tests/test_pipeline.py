@@ -0,0 +1,50 @@
+# Author: Brandon Le
+
+# run_pipeline with download stages that fail, no server needed
+# Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+
+import contextlib
+import io
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from downloader import Media
+from pipeline import Job, run_pipeline
+
+# Constants
+TIMEOUT = 10 # seconds before a pipeline counts as hung
+
+def fetch_or_fail(sessions, job, progress=None, control=None):
+    """Download stage that raises on every odd media id, like writing into a folder that is gone"""
+    if int(job.key) % 2:
+        raise FileNotFoundError(2, "No such file or directory", job.file_name)
+    return {"size": 1}
+
+class PipelineTest(unittest.TestCase):
+    def run_jobs(self, jobs, workers):
+        """Results of a pipeline, failing the test if it does not finish"""
+        results = []
+        output = io.StringIO()
+        def consume():
+            with contextlib.redirect_stdout(output):
+                results.extend(run_pipeline(jobs, workers, fetch=fetch_or_fail))
+        thread = threading.Thread(target=consume, daemon=True)
+        thread.start()
+        thread.join(TIMEOUT)
+        self.assertFalse(thread.is_alive(), "pipeline hung")
+        return results, output.getvalue()
+
+    def test_failing_fetch_fails_job(self):
+        jobs = [Job(Media.photo, f"https://images.pexels.com/photos/{number}/", f"missing/{number}.jpeg", str(number))
+            for number in range(20)]
+        results, output = self.run_jobs(jobs, workers=4)
+        self.assertEqual(len(results), 20) # No worker died, every Job has its Result
+        self.assertEqual(sorted(int(result.job.key) for result in results if result.ok), list(range(0, 20, 2)))
+        self.assertEqual(output.count("Problem downloading"), 10)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# Author: Brandon Le
+
+# Resumable downloads against a local server that drops connections mid-stream
+# Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import downloader
+import pexels_api
+import pipeline
+from downloader import PART_SUFFIX, RANGE_MIN_SIZE, SessionPool, download_file
+from manifest import JOB_FILE
+from mock_pexels import API_KEY, MockPexels, make_collections
+from scheduler import RateLimitError, RequestScheduler
+from server import FileHandler, LocalServer
+
+# Constants
+FILE_SIZE = 320 * 1024
+# Bytes of a response body sent before the connection drops, a multiple of the client's read
+# buffer (CHUNK_SIZE) so every byte sent reaches the .part file
+CUT_AFTER = 128 * 1024
+
+class CutHandler(FileHandler):
+    """Serve the server's content, cutting the first cuts response bodies off after CUT_AFTER bytes
+    With ranges=False every request is answered with the whole file, Range headers are ignored.
+    """
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        if self.server.ranges:
+            self.send_file(len(self.server.content), self.server.content)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.content)))
+        self.end_headers()
+        self.send_body(0, len(self.server.content), self.server.content)
+
+    def send_body(self, start, end, prefix=b""):
+        if self.server.cuts > 0:
+            self.server.cuts -= 1
+            self.wfile.write(prefix[start:min(end, start + CUT_AFTER)])
+            self.close_connection = True
+            return
+        super().send_body(start, end, prefix)
+
+def cut_server(content, cuts=1, ranges=True):
+    return LocalServer(CutHandler, content=content, cuts=cuts, ranges=ranges, requests=[])
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(downloader, "RETRY_DELAY", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+        self.file_name = os.path.join(self.dir, "pexels-photo-1.jpeg")
+
+    def download(self, server, **options):
+        with SessionPool(1) as sessions:
+            return download_file(sessions, f"{server.url}/files/pexels-photo-1.jpeg", self.file_name, **options)
+
+    def assert_downloaded(self, info, content):
+        self.assertIsNotNone(info)
+        self.assertEqual(info["size"], len(content))
+        self.assertEqual(info["sha256"], hashlib.sha256(content).hexdigest())
+        with open(self.file_name, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.dir), [os.path.basename(self.file_name)])
+
+    def test_resumes_with_range(self):
+        content = random.Random(1).randbytes(FILE_SIZE)
+        with cut_server(content, cuts=2) as server:
+            info = self.download(server)
+        self.assert_downloaded(info, content)
+        self.assertEqual(server.httpd.requests, [None, f"bytes={CUT_AFTER}-", f"bytes={2 * CUT_AFTER}-"])
+
+    def test_restarts_when_server_ignores_range(self):
+        content = random.Random(2).randbytes(FILE_SIZE)
+        with cut_server(content, ranges=False) as server:
+            info = self.download(server)
+        self.assert_downloaded(info, content)
+        self.assertEqual(server.httpd.requests, [None, f"bytes={CUT_AFTER}-"]) # Answered with 200, written again
+
+    def test_resumes_ranged_transfer(self):
+        # Random bytes at the start of every range, zeros after, so a misplaced range changes the hash
+        size = RANGE_MIN_SIZE + FILE_SIZE
+        content = bytearray(size)
+        for start in range(0, size, -(-size // 4)):
+            content[start:start + 1024] = random.Random(start).randbytes(1024)
+        content = bytes(content)
+        # The first cut is the plain GET the client drops after its headers, then two ranges are cut
+        with cut_server(content, cuts=3) as server:
+            info = self.download(server, parts=4)
+        self.assert_downloaded(info, content) # No .part or .ranges file left either
+        requests = server.httpd.requests
+        self.assertIsNone(requests[0])
+        self.assertEqual(len(requests), 1 + 4 + 2) # Two of the four ranges were asked for again
+        self.assertTrue(all(header.startswith("bytes=") for header in requests[1:]))
+
+    def test_ranged_progress_in_order(self):
+        content = random.Random(4).randbytes(RANGE_MIN_SIZE + FILE_SIZE)
+        counts = []
+        with cut_server(content) as server:
+            info = self.download(server, parts=4, progress=lambda url, done, total: counts.append(done))
+        self.assert_downloaded(info, content)
+        self.assertEqual(counts, sorted(counts)) # Reported by four threads, never going backwards
+        self.assertEqual(counts[-1], len(content))
+
+    def test_gives_up_after_retries(self):
+        content = random.Random(3).randbytes(FILE_SIZE)
+        with cut_server(content, cuts=10) as server:
+            info = self.download(server, retries=1)
+        self.assertIsNone(info)
+        self.assertFalse(os.path.exists(self.file_name))
+        self.assertEqual(os.path.getsize(self.file_name + PART_SUFFIX), 2 * CUT_AFTER) # Kept for the next run
+
+class JobStateResumeTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name + "/"
+        self.auth = {"Authorization": API_KEY}
+        self.mock = MockPexels(make_collections([200], video_share=0), photo_size=4096, monthly_limit=3)
+        self.mock.__enter__()
+        self.addCleanup(self.mock.__exit__)
+        api_url = f"{self.mock.url}/v1/collections/"
+        for patcher in (mock.patch.object(pipeline, "COLLECTION_API", api_url),
+                mock.patch.object(pexels_api, "COLLECTION_API", api_url), mock.patch.object(pexels_api, "cache", None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def sync(self):
+        """A fresh CollectionSync, after the API key check that tells the scheduler the quota left"""
+        pexels_api.scheduler = RequestScheduler()
+        self.assertTrue(pexels_api.check_api_key({"pexels_api_key": API_KEY}))
+        return pipeline.CollectionSync("mock00000", self.auth, 200, downloader.Media.photo, ["original"],
+            self.dir, workers=4)
+
+    def test_resumes_after_rate_limit(self):
+        # Three pages of 80 media and two requests left after the key check
+        first = []
+        with self.assertRaises(RateLimitError):
+            for result in self.sync():
+                first.append(result)
+        self.assertEqual(len(first), 160)
+        self.assertTrue(all(result.ok for result in first))
+        self.assertTrue(os.path.exists(os.path.join(self.dir, JOB_FILE.format("mock00000"))))
+        self.assertEqual(self.mock.api_requests, 3) # Page 3 was never sent
+
+        self.mock.httpd.remaining = 10 # A new quota period
+        second = list(self.sync())
+        self.assertEqual(len(second), 40) # Nothing downloaded twice
+        self.assertTrue(all(result.ok for result in second))
+        self.assertEqual(self.mock.api_requests, 3 + 2) # The key check and page 3
+        self.assertFalse(os.path.exists(os.path.join(self.dir, JOB_FILE.format("mock00000"))))
+        photos = [name for name in os.listdir(self.dir) if name.endswith(".jpeg")]
+        self.assertEqual(len(photos), 200)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# Author: Brandon Le
+
+# RequestScheduler's handling of 429 responses, against canned responses instead of the API
+# Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+
+import datetime
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import RateLimitError, RequestScheduler
+
+# Constants
+HOURLY_LIMIT = 3600 * 1000 # A drained bucket refills in a millisecond
+RESET = int(time.time()) + 3600
+
+class Response:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+        self.elapsed = datetime.timedelta(0)
+
+def quota_headers(remaining):
+    return {"X-Ratelimit-Limit": "20000", "X-Ratelimit-Remaining": str(remaining), "X-Ratelimit-Reset": str(RESET)}
+
+class Session:
+    """Answers with the given responses in turn, then with the last one"""
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.sent = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.sent += 1
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = RequestScheduler(hourly_limit=HOURLY_LIMIT)
+
+    def request(self, session):
+        return self.scheduler.request(session, "https://api.pexels.com/v1/collections/", {}, 1)
+
+    def test_burst_does_not_use_up_quota(self):
+        # Hourly bursts come without quota headers, the month's quota is fine
+        busy = Response(429, {"Retry-After": "0"})
+        session = Session([busy] * 5 + [Response(200, quota_headers(19000))])
+        self.assertEqual(self.request(session).status_code, 429) # Given up after the retries
+        self.assertEqual(session.sent, 5)
+        self.assertIsNone(self.scheduler.quota.remaining)
+        for _ in range(3):
+            self.assertEqual(self.request(session).status_code, 200)
+        self.assertEqual(self.scheduler.quota.remaining, 19000 - 2)
+
+    def test_retries_burst(self):
+        session = Session([Response(429, {"Retry-After": "0", **quota_headers(10)}), Response(200, quota_headers(9))])
+        self.assertEqual(self.request(session).status_code, 200)
+        self.assertEqual(session.sent, 2)
+
+    def test_used_up_quota_raises(self):
+        session = Session([Response(429, quota_headers(0))])
+        with self.assertRaises(RateLimitError):
+            self.request(session)
+        with self.assertRaises(RateLimitError): # Not even sent
+            self.request(session)
+        self.assertEqual(session.sent, 1)
+
+if __name__ == "__main__":
+    unittest.main()
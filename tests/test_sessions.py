@@ -0,0 +1,88 @@
+# Author: Brandon Le
+
+# Downloads behind a redirect to another host, like Pexels video downloads: SessionPool keep-alive
+# and ranged transfers
+# Run from the repository root: python -m pytest tests (or python -m unittest discover tests)
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from downloader import RANGE_MIN_SIZE, SessionPool, download_file
+from server import FileHandler, LocalServer
+
+# Constants
+DOWNLOADS = 10
+
+class CountingFileHandler(FileHandler):
+    """Serve a file of the server's file_size, counting the connections opened"""
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.send_file(self.server.file_size, b"video\n", "video/mp4")
+
+class RedirectHandler(BaseHTTPRequestHandler):
+    """Redirect every request to the file server, like www.pexels.com/video/<id>/download"""
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests += 1
+        self.send_response(302)
+        self.send_header("Location", f"{self.server.target}{self.path}.mp4")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def redirect_servers(file_size):
+    """A file server and a server redirecting to it under another host name, returns both and the latter's url"""
+    files = LocalServer(CountingFileHandler, connections=0, file_size=file_size)
+    www = LocalServer(RedirectHandler, connections=0, requests=0, target=files.url)
+    return files, www, www.url.replace("127.0.0.1", "localhost")
+
+class RedirectTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.dir = temp_dir.name
+
+    def test_keeps_connections_across_hosts(self):
+        files, www, www_url = redirect_servers(4096)
+        with files, www, SessionPool(1) as sessions:
+            for number in range(DOWNLOADS):
+                info = download_file(sessions, f"{www_url}/video/{number}/download",
+                    os.path.join(self.dir, f"{number}.mp4"))
+                self.assertIsNotNone(info)
+        # One worker, so one kept-alive connection to each host
+        self.assertEqual(www.httpd.connections, 1)
+        self.assertEqual(files.httpd.connections, 1)
+
+    def test_ranges_skip_redirect(self):
+        size = RANGE_MIN_SIZE + 4096
+        files, www, www_url = redirect_servers(size)
+        file_name = os.path.join(self.dir, "1.mp4")
+        with files, www, SessionPool(1) as sessions:
+            info = download_file(sessions, f"{www_url}/video/1/download", file_name, parts=4)
+        self.assertIsNotNone(info)
+        self.assertEqual(www.httpd.requests, 1) # Only the first request went through the redirect
+        content = (b"video\n" + bytes(size))[:size]
+        self.assertEqual(info["sha256"], hashlib.sha256(content).hexdigest())
+        with open(file_name, 'rb') as f:
+            self.assertEqual(hashlib.sha256(f.read()).hexdigest(), info["sha256"])
+
+if __name__ == "__main__":
+    unittest.main()